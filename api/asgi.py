@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from image_api.asgi import with_image_events  # noqa: E402
+
+application = with_image_events(django_application)
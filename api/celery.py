@@ -1,6 +1,8 @@
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 from django.conf import settings
+from prometheus_client import multiprocess, start_http_server
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
@@ -8,4 +10,24 @@ app = Celery('api')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# CPU-bound Pillow work runs on its own prefork worker, everything else stays on the eventlet worker
+THUMBNAIL_QUEUE = 'thumbnails'
+app.conf.task_routes = {
+    'image_api.tasks.create_thumbnail_sizes': {'queue': THUMBNAIL_QUEUE},
+}
+
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs) -> None:
+    """Serve the task metrics of the worker and its pool processes for Prometheus to scrape"""
+    if settings.CELERY_WORKER_METRICS_PORT:
+        from image_api.metrics import metrics_registry
+        start_http_server(settings.CELERY_WORKER_METRICS_PORT, registry=metrics_registry(include_queues=False))
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid: int, **kwargs) -> None:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -12,8 +12,9 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import config, Csv
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 import psycopg2
 import logging
 
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'image_api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +100,26 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Local memory when empty, as in tests and benchmarks
+CACHE_URL = config("CACHE_URL", default="")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CACHE_URL,
+    } if CACHE_URL else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+ACCOUNT_TIER_CACHE_TIMEOUT = config("ACCOUNT_TIER_CACHE_TIMEOUT", default=60 * 60, cast=int)
+# Listing and detail ETags embed version counters the Celery workers bump, so they are only sent when every process
+# shares the cache; a per-process one would keep answering 304 with stale thumbnails and statuses
+IMAGE_VERSION_ETAGS = bool(CACHE_URL)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -140,7 +162,7 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    "DEFAULT_AUTHENTICATION_CLASSES": ["rest_framework_simplejwt.authentication.JWTAuthentication", ],
+    "DEFAULT_AUTHENTICATION_CLASSES": ["image_api.authentication.CachedJWTAuthentication", ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10
 }
@@ -157,6 +179,11 @@ SIMPLE_JWT = {
     "SIGNING_KEY": config("SECRET_KEY"),
 }
 
+# Verified access tokens kept per process; a deactivated or deleted user reaches other processes once an entry ages out.
+# Access tokens themselves can't be revoked, simplejwt's blacklist only covers refresh tokens
+JWT_AUTH_CACHE_SIZE = config("JWT_AUTH_CACHE_SIZE", default=1024, cast=int)
+JWT_AUTH_CACHE_TTL = config("JWT_AUTH_CACHE_TTL", default=60, cast=int)
+
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
@@ -164,6 +191,106 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Only enforced by the prefork pool, recycling children to contain Pillow's memory growth
+CELERY_WORKER_MAX_TASKS_PER_CHILD = config("CELERY_WORKER_MAX_TASKS_PER_CHILD", default=100, cast=int)
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = config("CELERY_WORKER_MAX_MEMORY_PER_CHILD", default=512 * 1024, cast=int)  # KiB
+# Port a worker serves its Prometheus metrics on, disabled when 0
+CELERY_WORKER_METRICS_PORT = config("CELERY_WORKER_METRICS_PORT", default=0, cast=int)
+
+CELERY_BEAT_SCHEDULE = {
+    'reap-expired-expiration-links': {
+        'task': 'image_api.tasks.reap_expired_expiration_links',
+        'schedule': config("EXPIRATION_LINK_REAPER_INTERVAL", default=300, cast=int),
+    },
+    'reap-expired-upload-sessions': {
+        'task': 'image_api.tasks.reap_expired_upload_sessions',
+        'schedule': config("UPLOAD_SESSION_REAPER_INTERVAL", default=3600, cast=int),
+    },
+}
+
+EXPIRATION_LINK_REAPER_BATCH_SIZE = config("EXPIRATION_LINK_REAPER_BATCH_SIZE", default=1000, cast=int)
+EXPIRATION_LINK_REAPER_MAX_BATCHES = config("EXPIRATION_LINK_REAPER_MAX_BATCHES", default=100, cast=int)
+
+# Bearer token required by /metrics/, which is refused until one is set
+METRICS_AUTH_TOKEN = config("METRICS_AUTH_TOKEN", default="")
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# "filesystem" keeps files in MEDIA_ROOT, "s3" in an S3-compatible bucket shared by every web and worker node
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="filesystem")
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Seconds presigned media URLs in listings stay valid, 0 when media URLs are not signed
+MEDIA_URL_MAX_AGE = 0
+if STORAGE_BACKEND == "s3":
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotocoreConfig
+
+    S3_CUSTOM_DOMAIN = config("S3_CUSTOM_DOMAIN", default=None)
+    # django-storages never signs URLs on a custom domain, such as a CDN in front of a public bucket
+    S3_QUERYSTRING_AUTH = config("S3_QUERYSTRING_AUTH", default=not S3_CUSTOM_DOMAIN, cast=bool)
+    S3_QUERYSTRING_EXPIRE = config("S3_QUERYSTRING_EXPIRE", default=3600, cast=int)
+    if S3_QUERYSTRING_AUTH and not S3_CUSTOM_DOMAIN:
+        MEDIA_URL_MAX_AGE = S3_QUERYSTRING_EXPIRE
+
+    STORAGES["default"] = {
+        "BACKEND": "storages.backends.s3.S3Storage",
+        "OPTIONS": {
+            "bucket_name": config("S3_BUCKET_NAME"),
+            "endpoint_url": config("S3_ENDPOINT_URL", default=None),
+            "access_key": config("S3_ACCESS_KEY_ID", default=None),
+            "secret_key": config("S3_SECRET_ACCESS_KEY", default=None),
+            "region_name": config("S3_REGION_NAME", default=None),
+            "custom_domain": S3_CUSTOM_DOMAIN,
+            "querystring_auth": S3_QUERYSTRING_AUTH,
+            "querystring_expire": S3_QUERYSTRING_EXPIRE,
+            # Blob.acquire relies on colliding names getting a new name instead of replacing the object
+            "file_overwrite": False,
+            "transfer_config": TransferConfig(
+                multipart_threshold=config("S3_MULTIPART_THRESHOLD", default=8 * 1024 * 1024, cast=int),
+                multipart_chunksize=config("S3_MULTIPART_CHUNKSIZE", default=8 * 1024 * 1024, cast=int),
+                max_concurrency=config("S3_MAX_CONCURRENCY", default=4, cast=int),
+            ),
+            "client_config": BotocoreConfig(
+                max_pool_connections=config("S3_MAX_POOL_CONNECTIONS", default=20, cast=int),
+                retries={"max_attempts": 5, "mode": "standard"},
+                s3={"addressing_style": config("S3_ADDRESSING_STYLE", default="auto")},
+            ),
+        },
+    }
+
+# "django" streams files from Python, "x-accel-redirect" (nginx) and "x-sendfile" (Apache, lighttpd) hand them off
+MEDIA_SERVING_BACKEND = config("MEDIA_SERVING_BACKEND", default="django")
+MEDIA_ACCEL_REDIRECT_PREFIX = config("MEDIA_ACCEL_REDIRECT_PREFIX", default="/protected-media/")
+if MEDIA_SERVING_BACKEND == "x-sendfile" and STORAGE_BACKEND != "filesystem":
+    # X-Sendfile names a path on the web server's disk, objects in a bucket have none
+    raise ImproperlyConfigured("MEDIA_SERVING_BACKEND=x-sendfile needs STORAGE_BACKEND=filesystem")
+# Seconds clients may reuse image files and thumbnails before revalidating them with their ETag
+IMAGE_CACHE_MAX_AGE = config("IMAGE_CACHE_MAX_AGE", default=86400, cast=int)
+
+FILE_UPLOAD_HANDLERS = ["image_api.upload_handlers.ImageUploadHandler"]
+
+IMAGE_UPLOAD_MAX_BYTES = config("IMAGE_UPLOAD_MAX_BYTES", default=200 * 1024 * 1024, cast=int)
+IMAGE_UPLOAD_MAX_PIXELS = config("IMAGE_UPLOAD_MAX_PIXELS", default=60_000_000, cast=int)
+IMAGE_HEADER_MAX_BYTES = 256 * 1024
+IMAGE_BATCH_MAX_FILES = config("IMAGE_BATCH_MAX_FILES", default=50, cast=int)
+# Chunks of resumable uploads are kept in the default storage under this prefix, so any node can take the next one
+UPLOAD_SESSION_PREFIX = config("UPLOAD_SESSION_PREFIX", default="upload_sessions/")
+# Seconds an upload session may go without a chunk before it is reaped with its chunks
+UPLOAD_SESSION_MAX_AGE = config("UPLOAD_SESSION_MAX_AGE", default=24 * 3600, cast=int)
+
+# Redis used to push thumbnail status to images/events/ streams, disabled when empty
+IMAGE_EVENTS_REDIS_URL = config("IMAGE_EVENTS_REDIS_URL", default="")
+IMAGE_EVENTS_KEEPALIVE = config("IMAGE_EVENTS_KEEPALIVE", default=15, cast=int)
+IMAGE_EVENTS_MAX_AGE = config("IMAGE_EVENTS_MAX_AGE", default=300, cast=int)
+IMAGE_EVENTS_RETRY_MS = 5000
+
+THUMBNAIL_EAGER_RENDERING = config("THUMBNAIL_EAGER_RENDERING", default=True, cast=bool)
+THUMBNAIL_CACHE_DIR = config("THUMBNAIL_CACHE_DIR", default=os.path.join(BASE_DIR, 'thumbnail_cache'))
+THUMBNAIL_CACHE_MAX_BYTES = config("THUMBNAIL_CACHE_MAX_BYTES", default=512 * 1024 * 1024, cast=int)
+# Extra encodings of every thumbnail, served to clients whose Accept header names them, most preferred first.
+# AVIF encodes about 15 times slower than WebP, so it is opt-in
+THUMBNAIL_VARIANT_FORMATS = config("THUMBNAIL_VARIANT_FORMATS", default="WEBP", cast=Csv())
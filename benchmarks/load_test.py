@@ -0,0 +1,87 @@
+"""
+Requests per second and latency percentiles of the read paths, served by the WSGI app against the async views on ASGI.
+
+Every client thread keeps one connection open and requests its target back to back for the given duration. Run the
+web service (gunicorn/runserver, port 8000) and the asgi service (uvicorn, port 8001) from docker-compose, then:
+
+    python -m benchmarks.load_test --token <access token> --concurrency 32 --duration 30 \\
+        wsgi=http://localhost:8000/images/ asgi=http://localhost:8001/async/images/
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_TARGETS = ["wsgi=http://localhost:8000/images/", "asgi=http://localhost:8001/async/images/"]
+
+
+def connect(url: str) -> http.client.HTTPConnection:
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return connection_class(parts.netloc, timeout=30)
+
+
+def run_client(url: str, headers: dict, deadline: float, latencies: list[float], errors: list[int]) -> None:
+    parts = urlsplit(url)
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+    connection = connect(url)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = connect(url)
+            errors.append(0)
+            continue
+        if response.status >= 400:
+            errors.append(response.status)
+        else:
+            latencies.append(time.perf_counter() - started)
+    connection.close()
+
+
+def run(url: str, token: str, concurrency: int, duration: float) -> tuple[list[float], list[int]]:
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    clients = [threading.Thread(target=run_client, args=(url, headers, deadline, latencies, errors))
+               for _ in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return latencies, errors
+
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS, help="name=url pairs to load")
+    parser.add_argument("--token", default="", help="JWT access token sent as a Bearer header")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=2)
+    args = parser.parse_args()
+
+    print(f"concurrency {args.concurrency}, {args.duration}s per target")
+    print("target\trequests\terrors\trps\tp50_ms\tp99_ms")
+    for target in args.targets:
+        name, _, url = target.partition("=")
+        run(url, args.token, args.concurrency, args.warmup)
+        latencies, errors = run(url, args.token, args.concurrency, args.duration)
+        print(f"{name}\t{len(latencies)}\t{len(errors)}\t{len(latencies) / args.duration:.1f}"
+              f"\t{percentile(latencies, 0.5) * 1000:.1f}\t{percentile(latencies, 0.99) * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
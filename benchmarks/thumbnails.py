@@ -0,0 +1,85 @@
+"""
+Per-upload CPU time and peak RSS of thumbnail generation, before and after the single-decode pipeline.
+
+The sample and each variant run in fresh interpreters, as Linux carries ru_maxrss over fork and exec:
+
+    python -m benchmarks.thumbnails --megapixels 24 --sizes 200 400
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from types import SimpleNamespace
+
+from PIL import Image as PILImage
+
+from image_api.thumbnails import render_thumbnails
+
+
+def create_sample(path: str, megapixels: float, image_format: str) -> None:
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    noise = PILImage.effect_noise((width // 8, height // 8), 64).resize((width, height))
+    gradient = PILImage.linear_gradient("L").resize((width, height))
+    PILImage.merge("RGB", (noise, gradient, noise)).save(path, image_format)
+
+
+def legacy(image_path: str, sizes: list[int]) -> None:
+    original = PILImage.open(image_path)
+    root, ext = os.path.splitext(image_path)
+    for size in sizes:
+        resized = original.resize(size=(size, size))
+        resized.save(f"{root}_{size}x{size}{ext}")
+
+
+def pipeline(image_path: str, sizes: list[int]) -> None:
+    root, _ = os.path.splitext(image_path)
+    specs = [SimpleNamespace(width=None, height=size, fit="contain", format="", quality=80, progressive=True)
+             for size in sizes]
+    for thumbnail in render_thumbnails(image_path, specs):
+        thumbnail.save(f"{root}_x{thumbnail.spec.height}{thumbnail.extension}")
+
+
+VARIANTS = {"before": legacy, "after": pipeline}
+
+
+def measure(variant: str, image_path: str, sizes: list[int]) -> None:
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    VARIANTS[variant](image_path, sizes)
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (end.ru_utime - start.ru_utime) + (end.ru_stime - start.ru_stime)
+    print(f"{variant}\t{cpu:.3f}\t{end.ru_maxrss / 1024:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 400])
+    parser.add_argument("--format", choices=["JPEG", "PNG"], default="JPEG")
+    parser.add_argument("--create", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--measure", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--image", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.create:
+        create_sample(args.image, args.megapixels, args.format)
+        return
+    if args.measure:
+        measure(args.measure, args.image, args.sizes)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = os.path.join(directory, f"sample.{args.format.lower()}")
+        subprocess.run([sys.executable, "-m", "benchmarks.thumbnails", "--create", "--image", image_path,
+                        "--megapixels", str(args.megapixels), "--format", args.format], check=True)
+        print(f"{args.megapixels} MP {args.format}, sizes {args.sizes}")
+        print("variant\tcpu_s\tpeak_rss_mb")
+        for variant in VARIANTS:
+            subprocess.run([sys.executable, "-m", "benchmarks.thumbnails", "--measure", variant, "--image", image_path,
+                            "--sizes", *map(str, args.sizes)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Thumbnail throughput of Celery's eventlet pool against the prefork pool used by the thumbnails queue.
+
+Every job renders and encodes the thumbnails of one sample original, as create_thumbnail_sizes does. The eventlet
+variant runs the jobs on a GreenPool like the eventlet worker, the prefork variant on a pool of forked processes like
+the prefork worker, both with the same concurrency:
+
+    python -m benchmarks.worker_pools --jobs 32 --concurrency 4 --megapixels 12
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from types import SimpleNamespace
+
+import eventlet
+
+from benchmarks.thumbnails import create_sample
+from image_api.thumbnails import render_thumbnails
+
+
+def render_job(image_path: str, sizes: list[int]) -> None:
+    specs = [SimpleNamespace(width=None, height=size, fit="contain", format="JPEG", quality=80, progressive=True)
+             for size in sizes]
+    for thumbnail in render_thumbnails(image_path, specs):
+        thumbnail.save(BytesIO())
+
+
+def run_eventlet(image_path: str, sizes: list[int], jobs: int, concurrency: int) -> float:
+    pool = eventlet.GreenPool(concurrency)
+    started = time.perf_counter()
+    for _ in range(jobs):
+        pool.spawn_n(render_job, image_path, sizes)
+    pool.waitall()
+    return time.perf_counter() - started
+
+
+def run_prefork(image_path: str, sizes: list[int], jobs: int, concurrency: int) -> float:
+    with ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context("fork")) as pool:
+        # Start the children up front, as the prefork worker does before consuming
+        list(pool.map(abs, range(concurrency)))
+        started = time.perf_counter()
+        list(pool.map(render_job, [image_path] * jobs, [sizes] * jobs))
+        return time.perf_counter() - started
+
+
+POOLS = {"eventlet": run_eventlet, "prefork": run_prefork}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count())
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 400])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = os.path.join(directory, "sample.jpeg")
+        create_sample(image_path, args.megapixels, "JPEG")
+        print(f"{args.jobs} jobs, {args.megapixels} MP JPEG, sizes {args.sizes}, concurrency {args.concurrency}")
+        print("pool\tseconds\tjobs_per_s")
+        for pool, run in POOLS.items():
+            seconds = run(image_path, args.sizes, args.jobs, args.concurrency)
+            print(f"{pool}\t{seconds:.2f}\t{args.jobs / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 from django.contrib import admin
 
 # Register your models here.
-from image_api.models import Image, Account, AccountTier, ExpirationLink
+from image_api.models import Image, Account, AccountTier, ExpirationLink, ThumbnailSpec, Blob
+
+
+class ThumbnailSpecInline(admin.TabularInline):
+    model = ThumbnailSpec
+    extra = 0
+
+
+class AccountTierAdmin(admin.ModelAdmin):
+    inlines = [ThumbnailSpecInline]
+
 
 admin.site.register(Image)
 admin.site.register(Account)
-admin.site.register(AccountTier)
-admin.site.register(ExpirationLink)
\ No newline at end of file
+admin.site.register(AccountTier, AccountTierAdmin)
+admin.site.register(ExpirationLink)
+admin.site.register(Blob)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'image_api'
+
+    def ready(self):
+        from image_api import signals  # noqa: F401
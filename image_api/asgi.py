@@ -0,0 +1,82 @@
+import asyncio
+import json
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signals
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import reverse
+from rest_framework import status
+
+from image_api.authentication import authenticate_jwt
+from image_api.events import stream_image_events
+
+EVENT_STREAM_HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+
+async def send_error(send, error: str, status_code: int) -> None:
+    body = json.dumps({'error': error}).encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def relay_events(events, send) -> None:
+    async for event in events:
+        await send({"type": "http.response.body", "body": event.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def authenticate(scope) -> object | None:
+    # Same connection housekeeping as Django's ASGIHandler around the one query this stream makes
+    await sync_to_async(signals.request_started.send, thread_sensitive=True)(sender=ASGIRequest, scope=scope)
+    try:
+        return await authenticate_jwt(ASGIRequest(scope, BytesIO()), allow_query_token=True)
+    finally:
+        await sync_to_async(signals.request_finished.send, thread_sensitive=True)(sender=ASGIRequest)
+
+
+async def image_events(scope, receive, send) -> None:
+    """images/events/ as a raw ASGI application, closing the Redis subscription as soon as the client disconnects"""
+    if not settings.IMAGE_EVENTS_REDIS_URL:
+        return await send_error(send, 'Image events are not enabled', status.HTTP_503_SERVICE_UNAVAILABLE)
+    user = await authenticate(scope)
+    if user is None:
+        return await send_error(send, 'Authentication credentials were not provided.', status.HTTP_401_UNAUTHORIZED)
+
+    await send({"type": "http.response.start", "status": status.HTTP_200_OK, "headers": EVENT_STREAM_HEADERS})
+    events = stream_image_events(user.pk)
+    relay = asyncio.ensure_future(relay_events(events, send))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({relay, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (relay, disconnect):
+            task.cancel()
+        await asyncio.gather(relay, disconnect, return_exceptions=True)
+        await events.aclose()
+
+
+def with_image_events(application):
+    """Serve images/events/ outside Django's ASGIHandler, which in Django 4.2 never notices a client disconnecting"""
+    events_path = None
+
+    async def router(scope, receive, send):
+        nonlocal events_path
+        if scope["type"] == "http":
+            events_path = events_path or reverse('image-events')
+            if scope["path"] == events_path:
+                return await image_events(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
@@ -0,0 +1,115 @@
+from uuid import UUID
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.settings import api_settings
+
+from image_api.authentication import authenticate_jwt
+from image_api.etags import user_images_etag, not_modified, with_validators, make_etag, seconds_until
+from image_api.exceptions import ServiceException
+from image_api.serializers import ExpirationImageOutputSerializer
+from image_api.sendfile import serve_media
+from image_api.services import ImageService, ExpirationLinkService
+
+
+def error_response(error: Exception | str, status_code: int) -> JsonResponse:
+    return JsonResponse({'error': str(error)}, status=status_code)
+
+
+async def authenticate(request: HttpRequest) -> JsonResponse | None:
+    """Set request.user from the JWT, returning the 401 response when there is none"""
+    user = await authenticate_jwt(request)
+    if user is None:
+        return error_response('Authentication credentials were not provided.', status.HTTP_401_UNAUTHORIZED)
+    request.user = user
+    return None
+
+
+async def list_images(request: HttpRequest) -> HttpResponse:
+    """List all images associated with user, paginated by ?before=<id> and grouped by original with ?grouped=true"""
+    response = await authenticate(request)
+    if response is not None:
+        return response
+    service = ImageService(request=request)
+    try:
+        etag = await sync_to_async(user_images_etag)(request, 'json')
+        response = not_modified(request, etag=etag) or await list_images_page(request, service)
+        return with_validators(response, etag=etag, private=True, no_cache=True)
+    except (ServiceException, ValidationError) as e:
+        return error_response(e, status.HTTP_400_BAD_REQUEST)
+    except NotFound as e:
+        return error_response(e, status.HTTP_404_NOT_FOUND)
+
+
+async def list_images_page(request: HttpRequest, service: ImageService) -> JsonResponse:
+    page_size = api_settings.PAGE_SIZE
+    grouped = request.GET.get('grouped') in ('true', '1')
+    if grouped:
+        images = await sync_to_async(service.get_originals_based_on_tier)()
+    else:
+        images = await sync_to_async(service.get_images_based_on_tier)()
+
+    images = images.order_by('-id')
+    before = request.GET.get('before')
+    if before:
+        if not before.isdigit():
+            raise ValidationError('Invalid before cursor')
+        images = images.filter(id__lt=int(before))
+
+    page = [image async for image in images[:page_size + 1]]
+    if grouped:
+        data = await sync_to_async(service.return_grouped_image_sizes_based_on_tier)(page[:page_size])
+    else:
+        data = await sync_to_async(service.return_image_sizes_based_on_tier)(page[:page_size])
+
+    next_link = None
+    if len(page) > page_size:
+        query = request.GET.copy()
+        query['before'] = page[page_size - 1].pk
+        next_link = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+    return JsonResponse({'next': next_link, 'images': data})
+
+
+async def retrieve_image(request: HttpRequest, image_id: int) -> HttpResponse:
+    """Retrieve one user image"""
+    response = await authenticate(request)
+    if response is not None:
+        return response
+    service = ImageService(request=request)
+    try:
+        etag = await sync_to_async(user_images_etag)(request, 'json')
+        response = not_modified(request, etag=etag)
+        if response is None:
+            await service.avalidate_access_to_image(image_id=image_id)
+            images = [image async for image in service.get_specific_image_sizes(image_id=image_id)]
+            data = await sync_to_async(service.return_specific_image_sizes_based_on_tier)(image_id, images)
+            response = JsonResponse({'images': data})
+        return with_validators(response, etag=etag, private=True, no_cache=True)
+    except (ServiceException, ValidationError) as e:
+        return error_response(e, status.HTTP_400_BAD_REQUEST)
+    except NotFound as e:
+        return error_response(e, status.HTTP_404_NOT_FOUND)
+
+
+async def redeem_expiration_link(request: HttpRequest, link_id: UUID, download: bool = False) -> HttpResponse:
+    """Get image from expiration link"""
+    response = await authenticate(request)
+    if response is not None:
+        return response
+    try:
+        link = await ExpirationLinkService.aget_expiration_link(link_id=link_id)
+        image = link.image
+        etag = make_etag(image.etag, download) if image.etag else None
+        response = not_modified(request, etag=etag, last_modified=image.created_at)
+        if response is None and download:
+            response = await sync_to_async(serve_media)(image.image.name)
+        elif response is None:
+            response = JsonResponse(ExpirationImageOutputSerializer(image).data)
+        return with_validators(response, etag=etag, last_modified=image.created_at, private=True,
+                               max_age=seconds_until(link.expires_at))
+    except (ServiceException, ValidationError) as e:
+        return error_response(e, status.HTTP_400_BAD_REQUEST)
+    except NotFound as e:
+        return error_response(e, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,124 @@
+import base64
+import binascii
+import copy
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpRequest
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+
+class CachedToken(NamedTuple):
+    raw_token: bytes
+    token: Token
+    user: User
+    expires_at: float
+
+
+class TokenCache:
+    """Process-local LRU of verified tokens and their users, keyed on jti and bounded in size and age"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, CachedToken] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, jti: str, raw_token: bytes) -> CachedToken | None:
+        with self.lock:
+            entry = self.entries.get(jti)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self.entries[jti]
+                return None
+            # A token forged with a cached jti must not ride on the verified one
+            if not hmac.compare_digest(entry.raw_token, raw_token):
+                return None
+            self.entries.move_to_end(jti)
+            return entry
+
+    def set(self, jti: str, raw_token: bytes, token: Token, user: User) -> None:
+        expires_at = min(time.time() + self.ttl, token.get('exp', 0))
+        with self.lock:
+            self.entries[jti] = CachedToken(raw_token, token, copy.copy(user), expires_at)
+            self.entries.move_to_end(jti)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict_user(self, user_id: int) -> None:
+        with self.lock:
+            for jti in [jti for jti, entry in self.entries.items() if entry.user.pk == user_id]:
+                del self.entries[jti]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(settings.JWT_AUTH_CACHE_SIZE, settings.JWT_AUTH_CACHE_TTL)
+
+
+def unverified_jti(raw_token: bytes) -> str | None:
+    """Read the jti claim without checking the signature, only to find a cache entry"""
+    try:
+        payload = raw_token.split(b".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + b"=" * (-len(payload) % 4)))
+        return str(claims[api_settings.JTI_CLAIM])
+    except (IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that skips verification and the user query for tokens it has recently verified"""
+
+    def authenticate(self, request: Request) -> tuple[User, Token] | None:
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return self.authenticate_token(raw_token)
+
+    def authenticate_token(self, raw_token: bytes) -> tuple[User, Token]:
+        jti = unverified_jti(raw_token)
+        entry = token_cache.get(jti, raw_token) if jti else None
+        if entry is not None:
+            return copy.copy(entry.user), entry.token
+
+        token = self.get_validated_token(raw_token)
+        user = self.get_user(token)
+        if jti:
+            token_cache.set(jti, raw_token, token, user)
+        return user, token
+
+
+@sync_to_async
+def authenticate_jwt(request: HttpRequest, allow_query_token: bool = False) -> User | None:
+    """Authenticate from the Authorization header or, with allow_query_token, from ?token="""
+    authentication = CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    if header:
+        raw_token = authentication.get_raw_token(header)
+    else:
+        # Only for EventSource clients, which cannot set headers: query strings end up in access logs and caches
+        raw_token = request.GET.get("token", "").encode() if allow_query_token else None
+    if not raw_token:
+        return None
+    try:
+        user, _ = authentication.authenticate_token(raw_token)
+        return user
+    except AuthenticationFailed:
+        return None
@@ -0,0 +1,91 @@
+import hashlib
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.request import Request
+
+from image_api.models import Account
+
+
+def file_digest(file) -> str:
+    """Return the sha256 hex digest of a Django File, leaving it rewound"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def make_etag(*parts) -> str:
+    return quote_etag(hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()[:32])
+
+
+def image_version_key(user_id: int) -> str:
+    return f"image_version:{user_id}"
+
+
+def tier_version_key(tier_id: int) -> str:
+    return f"account_tier_version:{tier_id}"
+
+
+def get_versions(*keys: str) -> list[int]:
+    """Read version counters, seeding missing ones with the current time so a lost counter never repeats a value"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not seeded yet, the next reader seeds a value newer than any previous one
+        pass
+
+
+def media_url_epoch() -> int:
+    """Number of the period a listing's presigned media URLs were signed in, 0 when they are not signed"""
+    if not settings.MEDIA_URL_MAX_AGE:
+        return 0
+    # A 304 is only sent within the period the body was built in, so its URLs keep at least half their lifetime
+    return int(time.time()) // max(1, settings.MEDIA_URL_MAX_AGE // 2)
+
+
+def user_images_etag(request: Request, renderer_format: str | None = None) -> str | None:
+    """ETag of a user's image listing or detail, changing whenever their images or tier change"""
+    if not settings.IMAGE_VERSION_ETAGS:
+        return None
+    tier = Account.get_tier(user_id=request.user.pk)
+    versions = get_versions(image_version_key(request.user.pk), tier_version_key(tier.pk))
+    return make_etag(request.get_full_path(), renderer_format or request.accepted_renderer.format, tier.pk,
+                     media_url_epoch(), *versions)
+
+
+def seconds_until(expires_at: datetime) -> int:
+    return max(0, int((expires_at - timezone.now()).total_seconds()))
+
+
+def not_modified(request: Request, etag: str | None = None,
+                 last_modified: datetime | None = None) -> HttpResponse | None:
+    """Return a 304 response when the client's validators still match, before the response body is built"""
+    return get_conditional_response(request, etag=etag,
+                                    last_modified=last_modified and int(last_modified.timestamp()))
+
+
+def with_validators(response: HttpResponse, etag: str | None = None, last_modified: datetime | None = None,
+                    **cache_control) -> HttpResponse:
+    if etag:
+        response.headers["ETag"] = etag
+    if last_modified:
+        response.headers["Last-Modified"] = http_date(last_modified.timestamp())
+    patch_cache_control(response, **cache_control)
+    return response
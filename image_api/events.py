@@ -0,0 +1,55 @@
+import asyncio
+import json
+import logging
+from functools import lru_cache
+from typing import AsyncIterator
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def image_events_channel(user_id: int) -> str:
+    return f"image_events:{user_id}"
+
+
+@lru_cache
+def get_redis(url: str) -> redis.Redis:
+    return redis.Redis.from_url(url)
+
+
+def publish_image_event(user_id: int, image_id: int, status: str) -> None:
+    """Tell the user's open event streams that an image changed status, never failing the caller"""
+    if not settings.IMAGE_EVENTS_REDIS_URL:
+        return
+    try:
+        get_redis(settings.IMAGE_EVENTS_REDIS_URL).publish(image_events_channel(user_id),
+                                                           json.dumps({'id': image_id, 'status': status}))
+    except redis.RedisError:
+        logger.warning("Could not publish status of image %s", image_id, exc_info=True)
+
+
+async def stream_image_events(user_id: int) -> AsyncIterator[str]:
+    """Relay the user's image events from Redis pub/sub as server-sent events for at most IMAGE_EVENTS_MAX_AGE"""
+    client = redis.asyncio.from_url(settings.IMAGE_EVENTS_REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(image_events_channel(user_id))
+    loop = asyncio.get_running_loop()
+    # Ending the stream makes EventSource reconnect after the retry delay, bounding every connection's lifetime
+    deadline = loop.time() + settings.IMAGE_EVENTS_MAX_AGE
+    try:
+        yield f"retry: {settings.IMAGE_EVENTS_RETRY_MS}\n\n"
+        while (remaining := deadline - loop.time()) > 0:
+            message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                               timeout=min(settings.IMAGE_EVENTS_KEEPALIVE, remaining))
+            if message is None:
+                # Keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: image\ndata: {message['data'].decode()}\n\n"
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
+        await client.close()
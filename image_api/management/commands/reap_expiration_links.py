@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from image_api.tasks import reap_expired_expiration_links
+
+
+class Command(BaseCommand):
+    help = "Delete expired expiration links in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--max-batches", type=int, default=None)
+
+    def handle(self, *args, **options):
+        reaped = reap_expired_expiration_links(batch_size=options["batch_size"], max_batches=options["max_batches"])
+        self.stdout.write(self.style.SUCCESS(f"Reaped {reaped} expired expiration links"))
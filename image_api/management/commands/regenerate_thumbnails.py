@@ -0,0 +1,147 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from celery import chain
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from image_api.events import publish_image_event
+from image_api.models import Image
+from image_api.tasks import create_thumbnail_sizes, prune_stale_thumbnails, set_status
+
+
+def regenerate(user_id: int, image_id: int, prune: bool) -> None:
+    """Render the missing thumbnails of one original in a pool process"""
+    try:
+        create_thumbnail_sizes(user_id=user_id, image_id=image_id)
+    except Exception:
+        # Called directly, so ThumbnailTask.on_failure never runs and the original would stay processing
+        set_status(user_id, image_id, Image.Status.FAILED)
+        publish_image_event(user_id, image_id, Image.Status.FAILED)
+        raise
+    if prune:
+        prune_stale_thumbnails(user_id=user_id, image_id=image_id)
+
+
+def close_connections() -> None:
+    # Forked pool processes must open their own database connections
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Render the thumbnails existing originals are missing for their owner's current tier"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users", help="Only originals of this user id")
+        parser.add_argument("--tier", type=int, action="append", dest="tiers", help="Only originals of this tier id")
+        parser.add_argument("--backend", choices=["celery", "processes"], default="celery",
+                            help="Queue a task per original or render them here in a process pool")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Pool size of the processes backend")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--rate", type=float, default=0, help="Originals per second at most, 0 for no limit")
+        parser.add_argument("--checkpoint", help="File recording the last finished original, to resume from")
+        parser.add_argument("--prune", action="store_true",
+                            help="Also delete thumbnails of specs no longer in the tier and ones from before specs")
+
+    def handle(self, *args, **options):
+        if not settings.THUMBNAIL_EAGER_RENDERING:
+            raise CommandError("Thumbnails are rendered on request while THUMBNAIL_EAGER_RENDERING is off")
+
+        checkpoint = options["checkpoint"]
+        last_id = self.read_checkpoint(checkpoint)
+        originals = Image.objects.filter(original_photo=True, pk__gt=last_id).order_by("pk")
+        if options["users"]:
+            originals = originals.filter(account_id__in=options["users"])
+        if options["tiers"]:
+            originals = originals.filter(account__account__tier__in=options["tiers"])
+
+        total = originals.count()
+        if last_id:
+            self.stdout.write(f"Resuming after original {last_id}")
+        self.stdout.write(f"Regenerating thumbnails of {total} originals")
+
+        dispatch = self.dispatch_to_celery if options["backend"] == "celery" else self.run_in_processes
+        done = dispatch(originals.values_list("account_id", "pk"), total, options)
+        self.stdout.write(self.style.SUCCESS(f"Regenerated thumbnails of {done} originals"))
+
+    def chunks(self, originals, options):
+        """Yield chunks of (user_id, image_id) in primary key order, paced to --rate"""
+        chunk_size = options["chunk_size"]
+        rate = options["rate"]
+        started = time.monotonic()
+        sent = 0
+        last_id = 0
+        while True:
+            # One bounded query per chunk rather than a cursor held open for the whole run
+            chunk = []
+            for original in originals.filter(pk__gt=last_id)[:chunk_size].iterator():
+                if rate:
+                    time.sleep(max(0.0, started + sent / rate - time.monotonic()))
+                chunk.append(original)
+                sent += 1
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1][1]
+            if len(chunk) < chunk_size:
+                return
+
+    def dispatch_to_celery(self, originals, total: int, options) -> int:
+        started = time.monotonic()
+        done = 0
+        for chunk in self.chunks(originals, options):
+            for user_id, image_id in chunk:
+                task = create_thumbnail_sizes.si(user_id=user_id, image_id=image_id)
+                if options["prune"]:
+                    task = chain(task, prune_stale_thumbnails.si(user_id=user_id, image_id=image_id))
+                task.apply_async()
+            # Queued tasks are safe in the broker, so the chunk counts as finished
+            done += len(chunk)
+            self.report(chunk, done, total, started, options["checkpoint"])
+        return done
+
+    def run_in_processes(self, originals, total: int, options) -> int:
+        started = time.monotonic()
+        done = failed = 0
+        close_connections()
+        with ProcessPoolExecutor(options["workers"], mp_context=multiprocessing.get_context("fork"),
+                                 initializer=close_connections) as pool:
+            for chunk in self.chunks(originals, options):
+                futures = [(image_id, pool.submit(regenerate, user_id, image_id, options["prune"]))
+                           for user_id, image_id in chunk]
+                for image_id, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"Original {image_id} failed: {e}")
+                done += len(chunk)
+                # Only written once the whole chunk has finished, so resuming never skips an original
+                self.report(chunk, done, total, started, options["checkpoint"])
+        if failed:
+            self.stderr.write(self.style.WARNING(f"{failed} originals failed, rerun without --checkpoint to retry"))
+        return done - failed
+
+    def report(self, chunk: list, done: int, total: int, started: float, checkpoint: str | None) -> None:
+        if checkpoint:
+            self.write_checkpoint(checkpoint, chunk[-1][1])
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{done}/{total} originals ({done / elapsed if elapsed else 0:.1f}/s)")
+
+    @staticmethod
+    def read_checkpoint(path: str | None) -> int:
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint:
+            return json.load(checkpoint)["last_id"]
+
+    @staticmethod
+    def write_checkpoint(path: str, last_id: int) -> None:
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as checkpoint:
+            json.dump({"last_id": last_id}, checkpoint)
+        os.replace(temporary_path, path)
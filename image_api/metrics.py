@@ -0,0 +1,134 @@
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_LATENCY = Histogram("image_api_request_duration_seconds", "Request latency by endpoint",
+                            ["endpoint", "method", "status"])
+REQUEST_QUERIES = Histogram("image_api_request_queries", "Database queries per request by endpoint",
+                            ["endpoint", "method"], buckets=QUERY_BUCKETS)
+REQUEST_SIZE = Histogram("image_api_request_size_bytes", "Request body size by endpoint", ["endpoint"],
+                         buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("image_api_response_size_bytes", "Response body size by endpoint", ["endpoint"],
+                          buckets=SIZE_BUCKETS)
+THUMBNAIL_STAGE_LATENCY = Histogram("image_api_thumbnail_stage_duration_seconds",
+                                    "Time spent in each stage of rendering thumbnails", ["stage"])
+THUMBNAIL_TASK_LATENCY = Histogram("image_api_thumbnail_task_duration_seconds",
+                                   "create_thumbnail_sizes run time by outcome", ["outcome"])
+EXPIRATION_LINKS_REAPED = Counter("image_api_expiration_links_reaped_total",
+                                  "Expired expiration links deleted by reap_expired_expiration_links")
+EXPIRATION_LINK_REAPER_BATCH_LATENCY = Histogram("image_api_expiration_link_reaper_batch_duration_seconds",
+                                                 "Time to select and delete one batch of expired expiration links")
+
+
+class QueryCounter:
+    """Queries run for the request being served"""
+
+    def __init__(self):
+        self.count = 0
+
+
+# Context variables follow a request into the sync_to_async threads its views and ORM calls run in
+request_queries: ContextVar[QueryCounter | None] = ContextVar("request_queries", default=None)
+
+
+def count_request_query(execute, sql, params, many, context):
+    """Execute wrapper, installed on every connection, counting queries towards the current request"""
+    counter = request_queries.get()
+    if counter is not None:
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def endpoint(request: HttpRequest) -> str:
+    # URL names keep the label set bounded, unlike paths carrying ids
+    match = request.resolver_match
+    return match.view_name if match else "unmatched"
+
+
+def observe(request: HttpRequest, response: HttpResponse, seconds: float, queries: int) -> None:
+    name = endpoint(request)
+    REQUEST_LATENCY.labels(name, request.method, response.status_code).observe(seconds)
+    REQUEST_QUERIES.labels(name, request.method).observe(queries)
+    request_size = request.META.get("CONTENT_LENGTH")
+    if request_size and request_size.isdigit():
+        REQUEST_SIZE.labels(name).observe(int(request_size))
+    if not response.streaming:
+        RESPONSE_SIZE.labels(name).observe(len(response.content))
+    elif response.has_header("Content-Length"):
+        RESPONSE_SIZE.labels(name).observe(int(response["Content-Length"]))
+
+
+class MetricsMiddleware:
+    """Record latency, query count and payload sizes of every request per URL name"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        token = request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        observe(request, response, time.perf_counter() - started, queries.count)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        queries = QueryCounter()
+        token = request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        observe(request, response, time.perf_counter() - started, queries.count)
+        return response
+
+
+class CeleryQueueCollector(Collector):
+    """Messages waiting in each Celery queue, read from the broker at scrape time"""
+
+    def collect(self):
+        from api.celery import app, THUMBNAIL_QUEUE
+
+        gauge = GaugeMetricFamily("image_api_celery_queue_length", "Messages waiting in a Celery queue",
+                                  labels=["queue"])
+        try:
+            with app.connection_for_read() as broker:
+                channel = broker.default_channel
+                for queue in (app.conf.task_default_queue, THUMBNAIL_QUEUE):
+                    _, messages, _ = channel.queue_declare(queue=queue, passive=True)
+                    gauge.add_metric([queue], messages)
+        except Exception:
+            # An unreachable broker or undeclared queue must not fail the whole scrape
+            pass
+        yield gauge
+
+
+def metrics_registry(include_queues: bool = True) -> CollectorRegistry:
+    """Registry to expose, merging every process's samples when PROMETHEUS_MULTIPROC_DIR is set"""
+    registry = CollectorRegistry()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    if include_queues:
+        registry.register(CeleryQueueCollector())
+    return registry
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:49
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0003_image_original_photo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailSpec',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('fit', models.CharField(choices=[('contain', 'Contain'), ('cover', 'Cover'), ('crop', 'Crop')], default='contain', max_length=10)),
+                ('format', models.CharField(blank=True, choices=[('', 'Same as original'), ('JPEG', 'JPEG'), ('WEBP', 'WebP'), ('AVIF', 'AVIF')], default='JPEG', max_length=10)),
+                ('quality', models.PositiveSmallIntegerField(default=80, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('progressive', models.BooleanField(default=True)),
+                ('tier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thumbnail_specs', to='image_api.accounttier')),
+            ],
+            options={
+                'db_table': 'thumbnail_spec',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='thumbnailspec',
+            constraint=models.CheckConstraint(check=models.Q(('width__isnull', False), ('height__isnull', False), _connector='OR'), name='thumbnail_spec_has_dimension'),
+        ),
+        migrations.AddConstraint(
+            model_name='thumbnailspec',
+            constraint=models.UniqueConstraint(fields=('tier', 'width', 'height'), name='unique_thumbnail_spec_per_tier'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expirationlink',
+            index=models.Index(fields=['expires_at'], name='expiration_link_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0006_expiration_link_expires_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
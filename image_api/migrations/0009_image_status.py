@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+def clear_blank_renditions(apps, schema_editor):
+    # Thumbnails without a spec fingerprint must not collide in unique_rendition_per_original
+    Image = apps.get_model('image_api', 'Image')
+    Image.objects.filter(rendition='').update(rendition=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0008_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='rendition',
+            field=models.CharField(blank=True, default=None, max_length=100, null=True),
+        ),
+        migrations.RunPython(clear_blank_renditions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='image',
+            constraint=models.UniqueConstraint(fields=('thumbnail_sizes', 'rendition'), name='unique_rendition_per_original'),
+        ),
+    ]
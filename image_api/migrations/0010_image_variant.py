@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0009_image_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='variant',
+            field=models.CharField(blank=True, default=None, max_length=10, null=True),
+        ),
+    ]
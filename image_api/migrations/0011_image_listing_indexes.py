@@ -0,0 +1,70 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:26
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """CREATE INDEX CONCURRENTLY on PostgreSQL, a plain AddIndex on the SQLite test and benchmark databases"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+def concurrently(schema_editor) -> dict:
+    return {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+
+
+def drop_parent_index(apps, schema_editor):
+    # Lookups by original use the leading column of unique_rendition_per_original instead
+    Image = apps.get_model('image_api', 'Image')
+    column = Image._meta.get_field('thumbnail_sizes').column
+    for name in schema_editor._constraint_names(Image, [column], index=True, unique=False,
+                                                 type_=models.Index.suffix):
+        schema_editor.execute(schema_editor._delete_index_sql(Image, name, **concurrently(schema_editor)))
+
+
+def create_parent_index(apps, schema_editor):
+    Image = apps.get_model('image_api', 'Image')
+    field = Image._meta.get_field('thumbnail_sizes')
+    schema_editor.execute(schema_editor._create_index_sql(Image, fields=[field], **concurrently(schema_editor)))
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run in a transaction, in exchange writes to image are never blocked
+    atomic = False
+
+    dependencies = [
+        ('image_api', '0010_image_variant'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='image',
+            index=models.Index(condition=models.Q(('variant', None)), fields=['account', '-id'], name='image_account_recent_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='image',
+            index=models.Index(condition=models.Q(('original_photo', True)), fields=['account', '-id'], name='image_originals_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='image',
+                    name='thumbnail_sizes',
+                    field=models.ForeignKey(db_index=False, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thumbnails', to='image_api.image'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(drop_parent_index, create_parent_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_renditions(apps, schema_editor):
+    # Same manifest as Image.refresh_renditions, built for a batch of originals at a time
+    Image = apps.get_model('image_api', 'Image')
+    last_id = 0
+    while True:
+        original_ids = list(Image.objects.filter(thumbnail_sizes=None, pk__gt=last_id).order_by('pk')
+                            .values_list('pk', flat=True)[:BATCH_SIZE])
+        if not original_ids:
+            return
+        renditions = {original_id: {} for original_id in original_ids}
+        thumbnails = (Image.objects.filter(thumbnail_sizes__in=original_ids).order_by('pk')
+                      .values('id', 'thumbnail_sizes', 'image', 'width', 'height', 'rendition', 'variant', 'blob__size'))
+        for thumbnail in thumbnails:
+            key = thumbnail['rendition'] or f"{thumbnail['width']}x{thumbnail['height']}"
+            renditions[thumbnail['thumbnail_sizes']][key] = {
+                "id": thumbnail['id'],
+                "width": thumbnail['width'],
+                "height": thumbnail['height'],
+                "path": thumbnail['image'],
+                "bytes": thumbnail['blob__size'],
+                "variant": thumbnail['variant'],
+            }
+        Image.objects.bulk_update([Image(pk=original_id, renditions=manifest)
+                                   for original_id, manifest in renditions.items() if manifest], ['renditions'])
+        last_id = original_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Every batch of the backfill commits on its own instead of holding one transaction over the whole table
+    atomic = False
+
+    dependencies = [
+        ('image_api', '0011_image_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(fill_renditions, migrations.RunPython.noop),
+    ]
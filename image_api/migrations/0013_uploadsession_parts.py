@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_api', '0012_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='parts',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
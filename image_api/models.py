@@ -1,11 +1,18 @@
+import os
+from urllib.parse import urljoin
 from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
-from django.db.models import ImageField
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.validators import validate_comma_separated_integer_list, MinValueValidator, MaxValueValidator
+from django.db import models, transaction, IntegrityError
+from django.db.models import ImageField, Q, F
+from django.utils import timezone
 
-from image_api.utils import user_directory_path
+from image_api.thumbnails import parse_thumbnail_sizes, FIT_CONTAIN, FIT_COVER, FIT_CROP
+from image_api.utils import user_directory_path, blob_path
 
 from decouple import config
 
@@ -19,10 +26,71 @@ class AccountTier(models.Model):
     original_link = models.BooleanField(default=False)
     expiration_link = models.BooleanField(default=False)
 
+    @staticmethod
+    def cache_key(tier_id: int) -> str:
+        return f"account_tier:{tier_id}"
+
+    @staticmethod
+    def thumbnail_specs_cache_key(tier_id: int) -> str:
+        return f"thumbnail_specs:{tier_id}"
+
+    def get_thumbnail_specs(self) -> list['ThumbnailSpec']:
+        cache_key = self.thumbnail_specs_cache_key(self.pk)
+        specs = cache.get(cache_key)
+        if specs is None:
+            specs = list(self.thumbnail_specs.all()) or [
+                ThumbnailSpec(tier_id=self.pk, height=size, format=ThumbnailSpec.Format.ORIGINAL)
+                for size in parse_thumbnail_sizes(self.thumbnail_sizes)
+            ]
+            cache.set(cache_key, specs, settings.ACCOUNT_TIER_CACHE_TIMEOUT)
+        return specs
+
     class Meta:
         db_table = "account_tier"
 
 
+class ThumbnailSpec(models.Model):
+    class Fit(models.TextChoices):
+        CONTAIN = FIT_CONTAIN, "Contain"
+        COVER = FIT_COVER, "Cover"
+        CROP = FIT_CROP, "Crop"
+
+    class Format(models.TextChoices):
+        ORIGINAL = "", "Same as original"
+        JPEG = "JPEG", "JPEG"
+        WEBP = "WEBP", "WebP"
+        AVIF = "AVIF", "AVIF"
+
+    tier = models.ForeignKey(AccountTier, on_delete=models.CASCADE, related_name="thumbnail_specs")
+    width = models.PositiveIntegerField(default=None, null=True, blank=True)
+    height = models.PositiveIntegerField(default=None, null=True, blank=True)
+    fit = models.CharField(max_length=10, choices=Fit.choices, default=Fit.CONTAIN)
+    format = models.CharField(max_length=10, choices=Format.choices, default=Format.JPEG, blank=True)
+    quality = models.PositiveSmallIntegerField(default=80, validators=[MinValueValidator(1), MaxValueValidator(100)])
+    progressive = models.BooleanField(default=True)
+    # Set on the modern-format copies made by thumbnails.variant_spec
+    variant = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.width or ''}x{self.height or ''}"
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.name}-{self.fit}-{self.format or 'original'}-q{self.quality}{'-progressive' if self.progressive else ''}"
+
+    def __str__(self):
+        return f"{self.name} {self.fit} {self.format or 'original'}"
+
+    class Meta:
+        db_table = "thumbnail_spec"
+        constraints = [
+            models.CheckConstraint(check=Q(width__isnull=False) | Q(height__isnull=False),
+                                   name="thumbnail_spec_has_dimension"),
+            models.UniqueConstraint(fields=["tier", "width", "height"], name="unique_thumbnail_spec_per_tier"),
+        ]
+
+
 class Account(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     tier = models.ForeignKey(AccountTier, on_delete=models.CASCADE, default=1, null=False)
@@ -30,16 +98,81 @@ class Account(models.Model):
     @classmethod
     def get_or_create_account(cls, user_id: int) -> 'Account':
         try:
-            account = cls.objects.get(user_id=user_id)
+            account = cls.objects.select_related('tier').get(user_id=user_id)
         except cls.DoesNotExist:
             account = cls.objects.create(user_id=user_id, tier_id=1)
         return account
 
+    @staticmethod
+    def tier_cache_key(user_id: int) -> str:
+        return f"account_tier_id:{user_id}"
+
+    @classmethod
+    def get_tier(cls, user_id: int) -> AccountTier:
+        """Resolve the user's tier from the cache, falling back to get_or_create_account"""
+        tier_id = cache.get(cls.tier_cache_key(user_id))
+        tier = cache.get(AccountTier.cache_key(tier_id)) if tier_id is not None else None
+        if tier is None:
+            tier = cls.get_or_create_account(user_id=user_id).tier
+            cache.set_many({cls.tier_cache_key(user_id): tier.pk, AccountTier.cache_key(tier.pk): tier},
+                           settings.ACCOUNT_TIER_CACHE_TIMEOUT)
+        return tier
+
     class Meta:
         db_table = "account"
 
 
+class Blob(models.Model):
+    """Stored file shared by every Image with the same content, deleted when its last reference goes"""
+    digest = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def retain(cls, blob_id: int) -> bool:
+        return bool(cls.objects.filter(pk=blob_id).update(ref_count=F("ref_count") + 1))
+
+    @classmethod
+    def acquire(cls, file, digest: str) -> 'Blob':
+        """Take a reference on the blob for digest, storing file only the first time the digest is seen"""
+        blob = cls.objects.filter(digest=digest).only("id").first()
+        if blob is not None and cls.retain(blob.pk):
+            return cls.objects.get(pk=blob.pk)
+
+        _, extension = os.path.splitext(file.name)
+        name = default_storage.save(blob_path(digest, extension.lower()), file)
+        try:
+            with transaction.atomic():
+                return cls.objects.create(digest=digest, file=name, size=file.size, ref_count=1)
+        except IntegrityError:
+            # The same content was stored concurrently, keep that copy
+            blob = cls.acquire(file, digest)
+            if blob.file.name != name:
+                default_storage.delete(name)
+            return blob
+
+    @classmethod
+    def release(cls, blob_id: int) -> None:
+        """Drop a reference, deleting the blob and its file once nothing points at it"""
+        cls.objects.filter(pk=blob_id).update(ref_count=F("ref_count") - 1)
+        name = cls.objects.filter(pk=blob_id, ref_count=0).values_list("file", flat=True).first()
+        # Only delete while still unreferenced, a concurrent retain() keeps the blob alive
+        if name and cls.objects.filter(pk=blob_id, ref_count=0).delete()[0]:
+            transaction.on_commit(lambda: default_storage.delete(name))
+
+    class Meta:
+        db_table = "blob"
+
+
 class Image(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        PROCESSING = "processing"
+        READY = "ready"
+        FAILED = "failed"
+
     account = models.ForeignKey(User, on_delete=models.CASCADE)
     width = models.PositiveIntegerField()
     height = models.PositiveIntegerField()
@@ -47,15 +180,62 @@ class Image(models.Model):
     image = ImageField(upload_to=user_directory_path,
                        width_field="width",
                        height_field="height")
-    thumbnail_sizes = models.ForeignKey('self', default=None, null=True,
+    # Looked up through the leading column of unique_rendition_per_original instead of an index of its own
+    thumbnail_sizes = models.ForeignKey('self', default=None, null=True, db_index=False,
                                         on_delete=models.CASCADE, related_name="thumbnails")
+    etag = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    blob = models.ForeignKey(Blob, default=None, null=True, blank=True, on_delete=models.PROTECT,
+                             related_name="images")
+    # Fingerprint of the ThumbnailSpec a thumbnail was rendered with
+    rendition = models.CharField(max_length=100, default=None, null=True, blank=True)
+    # Thumbnail processing state of an original
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.READY)
+    # Format of a modern-format copy of a thumbnail, kept out of listings and served through Accept negotiation
+    variant = models.CharField(max_length=10, default=None, null=True, blank=True)
+    # Read-path cache of an original's thumbnail rows by rendition, rebuilt from them by refresh_renditions alone
+    renditions = models.JSONField(default=dict, blank=True)
 
     @property
     def url(self):
-        return f"{config('root_domain')}media/images/{self.image.name}"
+        return urljoin(config('root_domain'), self.image.url)
+
+    def get_thumbnail_url(self, size: str) -> str:
+        return f"{config('root_domain')}images/{self.pk}/thumb/{size}/"
+
+    def get_rendition_url(self, rendition: dict) -> str:
+        return urljoin(config('root_domain'), self.image.storage.url(rendition["path"]))
+
+    @classmethod
+    def refresh_renditions(cls, image_id: int) -> dict:
+        """Rebuild the rendition cache of an original from its thumbnail rows, which stay the source of truth"""
+        thumbnails = (cls.objects.filter(thumbnail_sizes=image_id).select_related('blob')
+                      .only('id', 'image', 'width', 'height', 'rendition', 'variant', 'blob', 'blob__size'))
+        renditions = {
+            thumbnail.rendition or f"{thumbnail.width}x{thumbnail.height}": {
+                "id": thumbnail.pk,
+                "width": thumbnail.width,
+                "height": thumbnail.height,
+                "path": thumbnail.image.name,
+                "bytes": thumbnail.blob.size if thumbnail.blob_id is not None else None,
+                "variant": thumbnail.variant,
+            }
+            for thumbnail in thumbnails
+        }
+        cls.objects.filter(pk=image_id).update(renditions=renditions)
+        return renditions
 
     class Meta:
         db_table = "image"
+        constraints = [
+            models.UniqueConstraint(fields=["thumbnail_sizes", "rendition"], name="unique_rendition_per_original"),
+        ]
+        # Listings filter on the owner and page newest first by id, variants are never listed. Filtering
+        # original_photo on top of image_account_recent_idx beats a wider (account, original_photo, id) index
+        indexes = [
+            models.Index(fields=["account", "-id"], condition=Q(variant=None), name="image_account_recent_idx"),
+            models.Index(fields=["account", "-id"], condition=Q(original_photo=True), name="image_originals_idx"),
+        ]
 
 
 class ExpirationLink(models.Model):
@@ -69,3 +249,43 @@ class ExpirationLink(models.Model):
 
     class Meta:
         db_table = "expiration_link"
+        indexes = [
+            models.Index(fields=["expires_at"], name="expiration_link_expires_idx"),
+        ]
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    account = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    image_format = models.CharField(max_length=10, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Storage names of the chunks received so far, in upload order
+    parts = models.JSONField(default=list, blank=True)
+    # Time of the last accepted chunk, sessions idle for UPLOAD_SESSION_MAX_AGE are reaped
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @property
+    def directory(self) -> str:
+        return f"{settings.UPLOAD_SESSION_PREFIX}{self.id}"
+
+    def part_name(self, first: int) -> str:
+        return f"{self.directory}/{first:020d}"
+
+    def delete_parts(self) -> None:
+        """Delete every stored chunk, including ones of requests that failed before recording them"""
+        try:
+            _, names = default_storage.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            default_storage.delete(f"{self.directory}/{name}")
+
+    @property
+    def url(self):
+        return f"{config('root_domain')}images/uploads/{self.id}/"
+
+    class Meta:
+        db_table = "upload_session"
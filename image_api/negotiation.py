@@ -0,0 +1,13 @@
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import BaseRenderer
+from rest_framework.request import Request
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Render errors with the first renderer, for views that negotiate the Accept header themselves"""
+
+    def select_parser(self, request: Request, parsers: list):
+        return parsers[0]
+
+    def select_renderer(self, request: Request, renderers: list[BaseRenderer], format_suffix: str | None = None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class ImageCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key, so deep pages cost the same as the first one"""
+    ordering = '-id'
+
+    def get_paginated_response(self, data: list) -> Response:
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'images': data,
+        })
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['images'] = response_schema['properties'].pop('results')
+        return response_schema
@@ -0,0 +1,132 @@
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Callable
+
+from django.conf import settings
+
+LOCK_STRIPES = 256
+# Eviction frees space down to this share of max_bytes, so a full cache is not scanned again on the next miss
+EVICT_TO = 0.9
+
+
+class RenditionCache:
+    """Bounded on-disk cache of rendered thumbnails, evicted least recently used first"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_directory = os.path.join(directory, ".locks")
+        # Running total of cached bytes, shared by every process using this directory
+        self.usage_path = os.path.join(self.lock_directory, "usage")
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    @contextmanager
+    def exclusive(self, name: str):
+        """Hold the lock file name, shared by every thread and process using this directory"""
+        os.makedirs(self.lock_directory, exist_ok=True)
+        with open(os.path.join(self.lock_directory, name), "wb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def lock(self, key: str):
+        """Hold an exclusive lock for key"""
+        stripe = int(hashlib.sha256(key.encode()).hexdigest()[:8], 16) % LOCK_STRIPES
+        return self.exclusive(f"{stripe}.lock")
+
+    def get(self, key: str) -> str | None:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_render(self, key: str, render: Callable[[str], None]) -> str:
+        """Return the cached file for key, calling render(path) once even when requested concurrently"""
+        path = self.get(key)
+        if path:
+            return path
+
+        with self.lock(key):
+            path = self.get(key)
+            if path:
+                return path
+
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                render(temporary_path)
+                size = os.path.getsize(temporary_path)
+                os.replace(temporary_path, path)
+            finally:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+
+        if self.add_usage(size) > self.max_bytes:
+            self.evict()
+        return path
+
+    def open_or_render(self, key: str, render: Callable[[str], None]):
+        try:
+            return open(self.get_or_render(key, render), "rb")
+        except FileNotFoundError:
+            # Evicted by a concurrent render between rendering and opening
+            return open(self.get_or_render(key, render), "rb")
+
+    def scan(self) -> list[tuple[float, int, str]]:
+        """mtime, size and path of every cached file"""
+        entries = []
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir() or bucket.path == self.lock_directory:
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def add_usage(self, size: int) -> int:
+        """Add size to the running total of cached bytes and return the new total"""
+        with self.exclusive("usage.lock"):
+            try:
+                with open(self.usage_path) as usage:
+                    total = int(usage.read()) + size
+            except (FileNotFoundError, ValueError):
+                # First use of the directory or an interrupted write, the scan already counts the new file
+                total = sum(entry_size for _, entry_size, _ in self.scan())
+            self.write_usage(total)
+        return total
+
+    def write_usage(self, total: int) -> None:
+        with open(self.usage_path, "w") as usage:
+            usage.write(str(total))
+
+    def evict(self) -> None:
+        """Delete least recently used files until the cache is back under EVICT_TO of max_bytes"""
+        with self.exclusive("usage.lock"):
+            entries = self.scan()
+            # The scan also corrects any drift of the running total, e.g. from files removed by hand
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+            self.write_usage(total)
+
+
+def get_rendition_cache() -> RenditionCache:
+    return RenditionCache(settings.THUMBNAIL_CACHE_DIR, settings.THUMBNAIL_CACHE_MAX_BYTES)
@@ -0,0 +1,32 @@
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, FileResponse
+from rest_framework.exceptions import NotFound
+
+X_ACCEL_REDIRECT = "x-accel-redirect"
+X_SENDFILE = "x-sendfile"
+
+
+def serve_media(name: str) -> HttpResponse:
+    """Respond with a stored file, handing the bytes off to the web server when MEDIA_SERVING_BACKEND allows it"""
+    content_type, _ = mimetypes.guess_type(name)
+    backend = settings.MEDIA_SERVING_BACKEND
+
+    if backend == X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = f"{settings.MEDIA_ACCEL_REDIRECT_PREFIX}{quote(name)}"
+        return response
+    if backend == X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = default_storage.path(name)
+        return response
+    # Signed links outlive their image, and released blobs or pruned thumbnails leave no file behind
+    try:
+        file = default_storage.open(name, "rb")
+    except FileNotFoundError:
+        raise NotFound('The image file no longer exists.')
+    # WSGI servers with a sendfile-capable wsgi.file_wrapper (e.g. gunicorn) stream this with os.sendfile
+    return FileResponse(file, content_type=content_type)
@@ -1,21 +1,11 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
-from rest_framework.fields import ImageField
-
 from image_api.models import Image
 
 
 class ImageSerializer(serializers.Serializer):
-    image = ImageField()
-
-
-class ImageOutputSerializer(serializers.Serializer):
-    size = serializers.CharField()
-    url = serializers.CharField()
-
-
-class ManyImagesOutputSerializer(serializers.Serializer):
-    images = ImageOutputSerializer(many=True)
+    image = serializers.FileField()
 
 
 class ExpirationLinkInputSerializer(serializers.Serializer):
@@ -25,13 +15,34 @@ class ExpirationLinkInputSerializer(serializers.Serializer):
                                               'max_value': 'Expires_in must be less than or equal to 30000 seconds.',
                                           }
                                           )
+    signed = serializers.BooleanField(default=False)
 
 
 class ExpirationLinkOutputSerializer(serializers.Serializer):
     url = serializers.URLField()
 
+
+class UploadSessionInputSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+
+
+class UploadSessionOutputSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    url = serializers.URLField()
+    size = serializers.IntegerField()
+    offset = serializers.IntegerField()
+
+
 class ExpirationImageOutputSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = ("image",)
         read_only_fields = fields
+
+
+class SignedExpirationImageOutputSerializer(serializers.Serializer):
+    image = serializers.SerializerMethodField()
+
+    def get_image(self, link) -> str:
+        return default_storage.url(link.image_name)
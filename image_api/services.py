@@ -1,16 +1,76 @@
+import os
+import shutil
+import tempfile
 from datetime import timedelta
+from typing import Iterable
 
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.generics import get_object_or_404
 from rest_framework.request import Request
 
 import magic
+from celery import group
+from PIL import Image as PILImage
 
+from image_api.etags import file_digest, bump_version, image_version_key
 from image_api.exceptions import ServiceException
-from image_api.models import Image, Account, ExpirationLink
-from image_api.serializers import ExpirationLinkInputSerializer
+from image_api.models import Image, Account, ExpirationLink, ThumbnailSpec, UploadSession, Blob
+from image_api.renditions import get_rendition_cache
+from image_api.serializers import ExpirationLinkInputSerializer, UploadSessionInputSerializer
+from image_api.signing import SignedExpirationLink
+from image_api.tasks import create_thumbnail_sizes
+from image_api.thumbnails import plan_thumbnail, render_thumbnails, negotiate_spec
+from image_api.upload_handlers import ALLOWED_EXTENSIONS, read_image_header
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def image_data(image: Image) -> dict:
+    return {
+        'size': f"{image.width}x{image.height}",
+        'url': image.url,
+    }
+
+
+def rendition_data(image: Image) -> list[dict]:
+    """Listing entries of the thumbnails in an original's rendition manifest, format variants left out"""
+    renditions = sorted((rendition for rendition in image.renditions.values() if not rendition["variant"]),
+                        key=lambda rendition: rendition["id"])
+    return [{'size': f"{rendition['width']}x{rendition['height']}", 'url': image.get_rendition_url(rendition)}
+            for rendition in renditions]
+
+
+def lazy_thumbnail_data(image: Image, specs: list[ThumbnailSpec]) -> list[dict]:
+    thumbnail_data_list = []
+    for spec in specs:
+        size, crop = plan_thumbnail((image.width, image.height), spec)
+        width, height = crop or size
+        thumbnail_data_list.append({
+            'size': f"{width}x{height}",
+            'url': image.get_thumbnail_url(spec.name),
+        })
+    return thumbnail_data_list
+
+
+def rendition_srcsets(image: Image) -> dict:
+    """srcset of an original's stored thumbnails and one per format variant, keyed by media type for <picture>"""
+    candidates = {}
+    for rendition in image.renditions.values():
+        widths = candidates.setdefault(rendition["variant"], {})
+        widths.setdefault(rendition["width"], image.get_rendition_url(rendition))
+    srcsets = {variant: ", ".join(f"{url} {width}w" for width, url in sorted(widths.items()))
+               for variant, widths in candidates.items()}
+    return {
+        'srcset': srcsets.pop(None, ""),
+        'sources': {PILImage.MIME.get(variant, f"image/{variant.lower()}"): srcset
+                    for variant, srcset in srcsets.items()},
+    }
 
 
 class ImageService:
@@ -20,76 +80,325 @@ class ImageService:
 
     @staticmethod
     def __validate_file_extension(file) -> bool:
-        allowed_extension = ["jpg", "jpeg", "png"]
+        if getattr(file, "image_format", None):
+            # Already sniffed from the first chunk by ImageUploadHandler
+            return True
         file_type = magic.from_buffer(file.read(2048))
+        file.seek(0)
         extension = file_type.split(' ')
-        if extension[0] not in allowed_extension + [ext.upper() for ext in allowed_extension]:
-            raise ServiceException(f"Invalid file extension. Allowed extensions are: {allowed_extension}")
+        if extension[0] not in ALLOWED_EXTENSIONS + [ext.upper() for ext in ALLOWED_EXTENSIONS]:
+            raise ServiceException(f"Invalid file extension. Allowed extensions are: {ALLOWED_EXTENSIONS}")
         return True
 
     def validate_access_to_image(self, image_id: int) -> bool:
         image = get_object_or_404(Image, id=image_id)
-        if image.account == self.user.pk or self.user.is_staff or self.user.is_superuser:
+        if image.account_id == self.user.pk or self.user.is_staff or self.user.is_superuser:
             return True
         raise ServiceException('Access to this image was denied')
 
+    def __build_image(self, file) -> Image:
+        self.__validate_file_extension(file=file)
+        etag = getattr(file, "etag", None) or file_digest(file)
+        blob = Blob.acquire(file, etag)
+        status = Image.Status.PENDING if settings.THUMBNAIL_EAGER_RENDERING else Image.Status.READY
+        return Image(account_id=self.user.pk, image=blob.file.name, original_photo=True, etag=etag, blob=blob,
+                     width=getattr(file, "image_width", None), height=getattr(file, "image_height", None),
+                     status=status)
+
     @transaction.atomic
     def create_image(self, file) -> Image:
-        self.__validate_file_extension(file=file)
-        return Image.objects.create(account_id=self.user.pk, image=file, original_photo=True)
+        image = self.__build_image(file)
+        image.save()
+        return image
 
-    def return_specific_image_sizes_based_on_tier(self, image_id: int) -> list:
-        account = Account.get_or_create_account(user_id=self.user.pk)
-        account_tier = account.tier
+    def create_images(self, files: list) -> tuple[list[tuple[File, Image]], list[tuple[File, str]]]:
+        """Store every valid file and insert their Image rows at once, returning created and rejected files"""
+        created, rejected = [], []
+        try:
+            for file in files:
+                try:
+                    created.append((file, self.__build_image(file)))
+                except ServiceException as e:
+                    rejected.append((file, str(e)))
+            with transaction.atomic():
+                Image.objects.bulk_create([image for _, image in created])
+        except BaseException:
+            # Blobs are stored before the insert, so a failed batch must not keep references to them
+            for _, image in created:
+                Blob.release(image.blob_id)
+            raise
+        # bulk_create skips post_save, so bump the listing version the signal would have
+        bump_version(image_version_key(self.user.pk))
+        return created, rejected
+
+    def schedule_thumbnails(self, image: Image) -> None:
+        if settings.THUMBNAIL_EAGER_RENDERING:
+            transaction.on_commit(lambda: create_thumbnail_sizes.delay(user_id=self.user.pk, image_id=image.pk))
+
+    def schedule_batch_thumbnails(self, images: list[Image]) -> None:
+        """Dispatch thumbnails for a batch as one Celery group"""
+        if settings.THUMBNAIL_EAGER_RENDERING and images:
+            signatures = [create_thumbnail_sizes.s(user_id=self.user.pk, image_id=image.pk) for image in images]
+            transaction.on_commit(lambda: group(signatures).apply_async())
+
+    async def avalidate_access_to_image(self, image_id: int) -> bool:
+        image = await Image.objects.only('account_id').filter(id=image_id).afirst()
+        if image is None:
+            raise NotFound('No Image matches the given query.')
+        if image.account_id == self.user.pk or self.user.is_staff or self.user.is_superuser:
+            return True
+        raise ServiceException('Access to this image was denied')
+
+    def get_specific_image_sizes(self, image_id: int) -> QuerySet[Image]:
+        # Thumbnails are read from the original's rendition manifest
+        return Image.objects.filter(id=image_id, account=self.user.pk, variant=None)
+
+    def return_specific_image_sizes_based_on_tier(self, image_id: int, images: Iterable[Image] | None = None) -> list:
+        account_tier = Account.get_tier(user_id=self.user.pk)
+
+        if images is None:
+            images = self.get_specific_image_sizes(image_id=image_id)
+        image = next((image for image in images if image.pk == image_id), None)
+        if image is None:
+            raise NotFound('No Image matches the given query.')
 
-        image = get_object_or_404(Image, id=image_id, account=self.user.pk)
-        thumbnails = Image.objects.filter(thumbnail_sizes=image_id)
         image_data_list = []
 
         if account_tier.original_link:
-            image_data_list.append({
-                'size': f"{image.width}x{image.height}",
-                'url': image.url,
-            })
-
-        thumbnail_data_list = [
-            {
-                'size': f"{thumbnail.width}x{thumbnail.height}",
-                'url': thumbnail.url,
-            }
-            for thumbnail in thumbnails
-        ]
-        image_data_list.extend(thumbnail_data_list)
+            image_data_list.append(image_data(image))
+
+        if not settings.THUMBNAIL_EAGER_RENDERING:
+            image_data_list.extend(lazy_thumbnail_data(image, account_tier.get_thumbnail_specs()))
+            return image_data_list
+
+        image_data_list.extend(rendition_data(image))
 
         return image_data_list
 
-    def return_image_sizes_based_on_tier(self) -> list[dict]:
-        account = Account.get_or_create_account(user_id=self.user.pk)
+    def get_originals_based_on_tier(self) -> QuerySet[Image]:
+        self.account_tier = Account.get_tier(user_id=self.user.pk)
+
+        fields = ['id', 'width', 'height', 'image']
+        if settings.THUMBNAIL_EAGER_RENDERING:
+            fields.append('renditions')
+        return Image.objects.filter(account=self.user.pk, original_photo=True).only(*fields)
 
-        account_tier = account.tier
+    def return_grouped_image_sizes_based_on_tier(self, originals: Iterable[Image]) -> list[dict]:
+        """Build the grouped listing for a page of get_originals_based_on_tier()"""
+        specs = self.account_tier.get_thumbnail_specs()
+        image_data_list = []
+        for original in originals:
+            original_data = {'id': original.pk}
+            if self.account_tier.original_link:
+                original_data.update(image_data(original))
+            if settings.THUMBNAIL_EAGER_RENDERING:
+                original_data['thumbnails'] = rendition_data(original)
+                # Thumbnail endpoints need a bearer token, which <img srcset> can't send, so lazy mode has none
+                original_data.update(rendition_srcsets(original))
+            else:
+                original_data['thumbnails'] = lazy_thumbnail_data(original, specs)
+            image_data_list.append(original_data)
+        return image_data_list
 
-        images = Image.objects.filter(account=self.user.pk)
+    def get_image_status(self, image_id: int) -> dict:
+        return get_object_or_404(Image.objects.values('id', 'status'), id=image_id, account=self.user.pk)
 
-        if not account_tier.original_link:
-            thumbnail_data_list = [
-                {
-                    'size': f"{image.width}x{image.height}",
-                    'url': image.url,
-                }
-                for image in images.filter(original_photo=False)
-            ]
-            return thumbnail_data_list
+    def get_image_for_download(self, image_id: int) -> Image:
+        image = get_object_or_404(Image.objects.only('id', 'image', 'thumbnail_sizes', 'etag', 'created_at'),
+                                  id=image_id, account=self.user.pk)
+        if image.thumbnail_sizes_id is None and not Account.get_tier(user_id=self.user.pk).original_link:
+            raise ServiceException("You don't have permission to download original images")
+        return image
 
-        image_data_list = [
-            {'size': f"{image.width}x{image.height}",
-             'url': image.url,
-             }
-            for image in images
-        ]
+    def get_images_based_on_tier(self) -> QuerySet[Image]:
+        self.account_tier = Account.get_tier(user_id=self.user.pk)
+
+        images = Image.objects.filter(account=self.user.pk, variant=None)
+
+        if not settings.THUMBNAIL_EAGER_RENDERING:
+            return images.filter(original_photo=True).only('id', 'width', 'height', 'image')
+        images = images.only('id', 'width', 'height', 'image', 'original_photo', 'renditions')
+        if not self.account_tier.original_link:
+            return images.filter(original_photo=False)
+        return images
+
+    def return_image_sizes_based_on_tier(self, images: Iterable[Image]) -> list[dict]:
+        """Build the listing for a page of get_images_based_on_tier()"""
+        if settings.THUMBNAIL_EAGER_RENDERING:
+            return [{**image_data(image), **rendition_srcsets(image)} if image.original_photo else image_data(image)
+                    for image in images]
+
+        specs = self.account_tier.get_thumbnail_specs()
+        image_data_list = []
+        for image in images:
+            if self.account_tier.original_link:
+                image_data_list.append(image_data(image))
+            image_data_list.extend(lazy_thumbnail_data(image, specs))
 
         return image_data_list
 
 
+class ThumbnailService:
+    def __init__(self, request: Request):
+        self.request = request
+        self.user = request.user
+
+    def get_thumbnail(self, image_id: int, size: str) -> tuple[Image, ThumbnailSpec]:
+        """Return the original and the spec of size, switched to the best format the client accepts"""
+        account_tier = Account.get_tier(user_id=self.user.pk)
+        spec = next((spec for spec in account_tier.get_thumbnail_specs() if spec.name == size), None)
+        if spec is None:
+            raise ServiceException(f"Thumbnail size {size} is not available for your tier")
+
+        image = get_object_or_404(Image, id=image_id, account=self.user.pk, thumbnail_sizes__isnull=True)
+        return image, negotiate_spec(spec, self.request.META.get("HTTP_ACCEPT", ""))
+
+    @staticmethod
+    def open_thumbnail(image: Image, spec: ThumbnailSpec):
+        """Return the stored or cached rendition file and its content type, rendering it on first request"""
+        file = None
+        if settings.THUMBNAIL_EAGER_RENDERING:
+            stored = image.renditions.get(spec.fingerprint)
+            if stored is not None:
+                file = image.image.storage.open(stored["path"], "rb")
+
+        def render(path: str) -> None:
+            with image.image.open("rb") as original:
+                render_thumbnails(original, [spec])[0].save(path)
+
+        if file is None:
+            file = get_rendition_cache().open_or_render(f"{image.image.name}:{spec.fingerprint}", render)
+        # The format also depends on the original's transparency, so it is read back from the header
+        image_format = PILImage.open(file).format
+        file.seek(0)
+        return file, PILImage.MIME.get(image_format, "application/octet-stream")
+
+
+class UploadSessionService:
+    def __init__(self, request: Request):
+        self.request = request
+        self.user = request.user
+
+    def create_upload_session(self) -> UploadSession:
+        serializer = UploadSessionInputSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if data['size'] > settings.IMAGE_UPLOAD_MAX_BYTES:
+            raise ServiceException("File is too large")
+        data['filename'] = os.path.basename(data['filename'])
+        return UploadSession.objects.create(account_id=self.user.pk, **data)
+
+    def get_upload_session(self, upload_id) -> UploadSession:
+        return get_object_or_404(UploadSession, id=upload_id, account=self.user.pk)
+
+    def __parse_content_range(self, session: UploadSession) -> tuple[int, int]:
+        """Return the first byte and length of the chunk described by a 'bytes start-end/total' header
+
+        'bytes */total' carries no bytes and retries completing an upload whose every chunk is stored already
+        """
+        try:
+            unit, byte_range = self.request.headers["Content-Range"].split(" ")
+            first_last, total = byte_range.split("/")
+            first, last = (session.size, session.size - 1) if first_last == "*" else \
+                (int(position) for position in first_last.split("-"))
+            total = int(total)
+        except (KeyError, ValueError):
+            raise ServiceException("Content-Range header must look like 'bytes start-end/total'")
+        if unit != "bytes" or total != session.size or (first_last != "*" and not first <= last < session.size):
+            raise ServiceException(f"Content-Range must describe bytes of a {session.size} bytes upload")
+        if first != session.offset:
+            raise ServiceException(f"Upload must resume from byte {session.offset}")
+        return first, last - first + 1
+
+    def __discard(self, session: UploadSession) -> None:
+        # Deleted through a queryset, which keeps session.id for removing its chunks afterwards
+        UploadSession.objects.filter(id=session.id).delete()
+        session.delete_parts()
+
+    @staticmethod
+    def __read_header(session: UploadSession) -> bytes:
+        """First bytes of the chunks stored so far, for sniffing a header split across chunks"""
+        header = b""
+        for name in session.parts:
+            with default_storage.open(name, "rb") as part:
+                header += part.read(settings.IMAGE_HEADER_MAX_BYTES - len(header))
+            if len(header) >= settings.IMAGE_HEADER_MAX_BYTES:
+                break
+        return header
+
+    def __write_chunk(self, session: UploadSession, length: int) -> None:
+        header = b"" if session.image_format else self.__read_header(session)
+        offset = session.offset
+        with tempfile.TemporaryFile() as chunk:
+            while length:
+                data = self.request.stream.read(min(UPLOAD_CHUNK_SIZE, length))
+                if not data:
+                    break
+                chunk.write(data)
+                offset += len(data)
+                length -= len(data)
+
+                if not session.image_format and len(header) < settings.IMAGE_HEADER_MAX_BYTES:
+                    header += data[:settings.IMAGE_HEADER_MAX_BYTES - len(header)]
+                    image_header = read_image_header(header, complete=offset == session.size)
+                    if image_header:
+                        session.image_format = image_header[0]
+
+            if offset > session.offset:
+                chunk.seek(0)
+                session.parts.append(default_storage.save(session.part_name(session.offset), File(chunk)))
+                session.offset = offset
+
+    @staticmethod
+    def __save_progress(session: UploadSession, first: int) -> None:
+        """Record the chunk only if no other request moved the session past first meanwhile"""
+        session.updated_at = timezone.now()
+        saved = UploadSession.objects.filter(id=session.id, offset=first).update(
+            offset=session.offset, image_format=session.image_format, parts=session.parts,
+            updated_at=session.updated_at)
+        if not saved:
+            if session.offset > first:
+                default_storage.delete(session.parts[-1])
+            raise ServiceException("Another request uploaded this chunk first, resume from the current offset")
+
+    def __complete(self, session: UploadSession) -> Image:
+        with tempfile.TemporaryFile() as file:
+            for name in session.parts:
+                with default_storage.open(name, "rb") as part:
+                    shutil.copyfileobj(part, file)
+            file.seek(0)
+            upload = File(file, name=session.filename)
+            upload.image_format = session.image_format
+            try:
+                with transaction.atomic():
+                    # Deleted first, so a concurrent completing retry waits on the row and then finds it gone
+                    deleted, _ = UploadSession.objects.filter(id=session.id).delete()
+                    if not deleted:
+                        raise ServiceException("This upload was completed by another request")
+                    image = ImageService(self.request).create_image(file=upload)
+            except ServiceException:
+                self.__discard(session)
+                raise
+        # Any other failure keeps the session, completed by a retry with 'Content-Range: bytes */size'
+        session.delete_parts()
+        return image
+
+    def upload_chunk(self, upload_id) -> UploadSession | Image:
+        """Append the request body to the upload, returning the created Image once the last chunk arrived"""
+        # The offset is claimed here and committed with compare-and-set, so no lock is held while the body streams in
+        session = self.get_upload_session(upload_id)
+        first, length = self.__parse_content_range(session)
+        try:
+            self.__write_chunk(session, length)
+        except ServiceException:
+            self.__discard(session)
+            raise
+        self.__save_progress(session, first)
+        if session.offset < session.size:
+            return session
+        return self.__complete(session)
+
+
 class ExpirationLinkService:
     def __init__(self, request: Request):
         self.user = request.user
@@ -97,9 +406,7 @@ class ExpirationLinkService:
         self.serializer = ExpirationLinkInputSerializer(data=self.request.data)
 
     def __validate_access_to_create_link(self, user_id: int) -> bool:
-        account = Account.get_or_create_account(user_id=user_id)
-
-        account_tier = account.tier
+        account_tier = Account.get_tier(user_id=user_id)
 
         if not account_tier.expiration_link:
             raise ServiceException(
@@ -107,23 +414,38 @@ class ExpirationLinkService:
 
         return True
 
-    def create_expiration_link(self, image_id: int) -> ExpirationLink:
+    def create_expiration_link(self, image_id: int) -> ExpirationLink | SignedExpirationLink:
+        """Create a revocable database row, or a signed link when signed is set"""
         self.__validate_access_to_create_link(user_id=self.user.pk)
         ImageService(self.request).validate_access_to_image(image_id=image_id)
         self.serializer.is_valid(raise_exception=True)
         data = self.serializer.validated_data
         image = get_object_or_404(Image, id=image_id, account=self.user.pk)
+        expires_at = timezone.now() + timedelta(seconds=data['expires_in'])
 
-        return ExpirationLink.objects.create(image=image,
-                                             expires_at=timezone.now() + timedelta(seconds=data['expires_in']))
+        if data['signed']:
+            return SignedExpirationLink(image.image.name, expires_at)
+        return ExpirationLink.objects.create(image=image, expires_at=expires_at)
 
     def __validate_expiration_link(self, link: ExpirationLink) -> bool:
         if link.expires_at < timezone.now():
-            link.delete()
             raise ValidationError('This link expired')
         return True
 
-    def get_image_from_expiration_link(self, link_id) -> Image:
-        link = get_object_or_404(ExpirationLink, id=link_id)
+    @staticmethod
+    async def aget_expiration_link(link_id) -> ExpirationLink:
+        link = await ExpirationLink.objects.select_related('image').filter(id=link_id).afirst()
+        if link is None:
+            raise NotFound('No ExpirationLink matches the given query.')
+        if link.expires_at < timezone.now():
+            raise ValidationError('This link expired')
+        return link
+
+    def get_expiration_link(self, link_id) -> ExpirationLink:
+        link = get_object_or_404(ExpirationLink.objects.select_related('image'), id=link_id)
         self.__validate_expiration_link(link=link)
-        return link.image
+        return link
+
+    @staticmethod
+    def get_signed_expiration_link(token: str) -> SignedExpirationLink:
+        return SignedExpirationLink.from_token(token)
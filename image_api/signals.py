@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from image_api.authentication import token_cache
+from image_api.etags import bump_version, image_version_key, tier_version_key
+from image_api.metrics import count_request_query
+from image_api.models import AccountTier, ThumbnailSpec, Account, Image, Blob
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_account_tier(sender, instance: Account, **kwargs) -> None:
+    cache.delete(Account.tier_cache_key(instance.user_id))
+    bump_version(image_version_key(instance.user_id))
+
+
+@receiver(post_save, sender=AccountTier)
+@receiver(post_delete, sender=AccountTier)
+def invalidate_tier(sender, instance: AccountTier, **kwargs) -> None:
+    cache.delete_many([AccountTier.cache_key(instance.pk), AccountTier.thumbnail_specs_cache_key(instance.pk)])
+    bump_version(tier_version_key(instance.pk))
+
+
+@receiver(post_save, sender=ThumbnailSpec)
+@receiver(post_delete, sender=ThumbnailSpec)
+def invalidate_thumbnail_specs(sender, instance: ThumbnailSpec, **kwargs) -> None:
+    cache.delete(AccountTier.thumbnail_specs_cache_key(instance.tier_id))
+    bump_version(tier_version_key(instance.tier_id))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def bump_image_version(sender, instance: Image, **kwargs) -> None:
+    bump_version(image_version_key(instance.account_id))
+
+
+@receiver(post_delete, sender=Image)
+def release_blob(sender, instance: Image, **kwargs) -> None:
+    if instance.blob_id is not None:
+        Blob.release(instance.blob_id)
+
+
+class RenditionRefresh:
+    """Rebuild the rendition cache of every original a transaction deleted thumbnails of, once each, on commit"""
+
+    def __init__(self):
+        self.image_ids = set()
+        self.done = False
+
+    def __call__(self) -> None:
+        self.done = True
+        # Originals deleted along with their thumbnails have nothing left to refresh
+        for image_id in Image.objects.filter(pk__in=self.image_ids).values_list('pk', flat=True):
+            Image.refresh_renditions(image_id)
+
+    @classmethod
+    def schedule(cls, image_id: int, using: str) -> None:
+        connection = transaction.get_connection(using)
+        refresh = getattr(connection, 'rendition_refresh', None)
+        # A rolled back savepoint drops its callbacks, so the refresh is pending only while it is still queued
+        pending = refresh is not None and not refresh.done and any(
+            func is refresh for _, func, _ in connection.run_on_commit)
+        if not pending:
+            refresh = connection.rendition_refresh = cls()
+        # Added before queueing, as outside a transaction on_commit runs the refresh right away
+        refresh.image_ids.add(image_id)
+        if not pending:
+            transaction.on_commit(refresh, using=using)
+
+
+@receiver(post_delete, sender=Image)
+def refresh_original_renditions(sender, instance: Image, using: str, **kwargs) -> None:
+    # A cache entry of a deleted thumbnail would point thumbnail downloads at a missing file
+    if instance.thumbnail_sizes_id is not None:
+        RenditionRefresh.schedule(instance.thumbnail_sizes_id, using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user_tokens(sender, instance: User, **kwargs) -> None:
+    # Deactivation or deletion takes effect immediately in this process, within JWT_AUTH_CACHE_TTL in the others
+    token_cache.evict_user(instance.pk)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs) -> None:
+    # Every thread opens its own connection, so queries are counted wherever a request's views run them
+    if count_request_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_request_query)
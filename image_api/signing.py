@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from decouple import config
+from django.core import signing
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+SALT = "image_api.expiration_link"
+
+
+class SignedExpirationLink:
+    """Stateless expiration link carrying the image path and expiry under an HMAC signature"""
+
+    def __init__(self, image_name: str, expires_at: datetime):
+        self.image_name = image_name
+        self.expires_at = expires_at
+
+    @property
+    def token(self) -> str:
+        return signing.Signer(salt=SALT).sign_object(
+            {"image": self.image_name, "expires_at": int(self.expires_at.timestamp())}, compress=True)
+
+    @property
+    def url(self):
+        return f"{config('root_domain')}images/expiration_link/signed/{self.token}/"
+
+    @classmethod
+    def from_token(cls, token: str) -> 'SignedExpirationLink':
+        try:
+            payload = signing.Signer(salt=SALT).unsign_object(token)
+        except signing.BadSignature:
+            raise ValidationError('This link is invalid')
+
+        link = cls(payload["image"], datetime.fromtimestamp(payload["expires_at"], tz=timezone.utc))
+        if link.expires_at < timezone.now():
+            raise ValidationError('This link expired')
+        return link
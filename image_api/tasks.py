@@ -1,32 +1,195 @@
+import hashlib
+import logging
 import os
-from celery import shared_task
+import time
+from datetime import timedelta
+from io import BytesIO
 
+from celery import shared_task, Task
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
 from PIL import Image as PILImage
 
-from image_api.models import Image, Account
+from image_api.etags import bump_version, image_version_key
+from image_api.events import publish_image_event
+from image_api.metrics import THUMBNAIL_STAGE_LATENCY, THUMBNAIL_TASK_LATENCY, EXPIRATION_LINKS_REAPED, \
+    EXPIRATION_LINK_REAPER_BATCH_LATENCY
+from image_api.models import Image, Account, ExpirationLink, Blob, UploadSession
+from image_api.thumbnails import render_thumbnails, with_variants
 
+logger = logging.getLogger(__name__)
+
+
+def set_status(user_id: int, image_id: int, status: str) -> None:
+    Image.objects.filter(account_id=user_id, id=image_id).update(status=status)
+    # update() skips post_save, so bump the listing version the signal would have
+    bump_version(image_version_key(user_id))
+
+
+class ThumbnailTask(Task):
+    def on_failure(self, exc, task_id, args, kwargs, einfo) -> None:
+        call = {**dict(zip(('user_id', 'image_id'), args)), **kwargs}
+        set_status(call['user_id'], call['image_id'], Image.Status.FAILED)
+        publish_image_event(call['user_id'], call['image_id'], Image.Status.FAILED)
+
+
+@shared_task(base=ThumbnailTask, autoretry_for=(Exception,),
+             dont_autoretry_for=(Image.DoesNotExist, PILImage.UnidentifiedImageError, PILImage.DecompressionBombError),
+             max_retries=5, retry_backoff=True, retry_backoff_max=600, retry_jitter=True)
+def create_thumbnail_sizes(user_id: int, image_id: int) -> None:
+    """Render the tier thumbnails of an original, safe to run again after a crash or alongside a duplicate"""
+    set_status(user_id, image_id, Image.Status.PROCESSING)
+    store_thumbnails(user_id=user_id, image_id=image_id)
+    set_status(user_id, image_id, Image.Status.READY)
+    publish_image_event(user_id, image_id, Image.Status.READY)
+
+
+# Start times of running create_thumbnail_sizes tasks by task id
+thumbnail_task_started = {}
+
+
+@task_prerun.connect(sender=create_thumbnail_sizes)
+def start_thumbnail_task_timer(task_id: str, **kwargs) -> None:
+    thumbnail_task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect(sender=create_thumbnail_sizes)
+def observe_thumbnail_task(task_id: str, state: str | None = None, **kwargs) -> None:
+    started = thumbnail_task_started.pop(task_id, None)
+    if started is not None:
+        THUMBNAIL_TASK_LATENCY.labels((state or "unknown").lower()).observe(time.perf_counter() - started)
 
-@shared_task
-def create_thumbnail_sizes(user_id: int, image_path: str, image_id: int) -> None:
-    account = Account.get_or_create_account(user_id=user_id)
 
-    account_tier = account.tier
+def store_thumbnails(user_id: int, image_id: int) -> None:
+    account_tier = Account.get_tier(user_id=user_id)
     image = Image.objects.get(account_id=user_id, id=image_id)
+    done = set(image.thumbnails.exclude(rendition=None).values_list('rendition', flat=True))
+    specs = [spec for spec in with_variants(account_tier.get_thumbnail_specs()) if spec.fingerprint not in done]
 
-    original = PILImage.open(image_path)
+    # Blobs are retained and stored outside any transaction, so they are released by hand if this run fails
+    thumbnails = []
+    try:
+        render_missing_thumbnails(image, specs, thumbnails)
+        with transaction.atomic():
+            # Serializes the final insert with concurrent runs for the same original
+            Image.objects.select_for_update().only('id').get(id=image_id)
+            done = set(Image.objects.filter(thumbnail_sizes=image_id).exclude(rendition=None)
+                       .values_list('rendition', flat=True))
+            Image.objects.bulk_create([thumbnail for thumbnail in thumbnails if thumbnail.rendition not in done])
+            Image.refresh_renditions(image_id)
+    except BaseException:
+        for thumbnail in thumbnails:
+            Blob.release(thumbnail.blob_id)
+        raise
+    # Renditions a concurrent run stored first are dropped along with their blob reference
+    for thumbnail in thumbnails:
+        if thumbnail.rendition in done:
+            Blob.release(thumbnail.blob_id)
+    # bulk_create skips post_save, so bump the listing version the signal would have
+    bump_version(image_version_key(image.account_id))
 
-    for thumbnail_size in account_tier.thumbnail_sizes.split(", "):
-        newsize = (int(thumbnail_size), int(thumbnail_size))
-        resized = original.resize(size=newsize)
 
-        root, ext = os.path.splitext(image_path)
+def render_missing_thumbnails(image: Image, specs: list, thumbnails: list[Image]) -> None:
+    """Append an unsaved thumbnail row per spec to thumbnails, reusing identical renditions of the same content"""
+    _, ext = os.path.splitext(image.image.name)
 
-        media_path = f"{root}_{thumbnail_size}x{thumbnail_size}{ext}"
-        resized.save(media_path)
+    # Thumbnails of the same content rendered with the same spec, possibly for another user
+    reusable = {}
+    if image.blob_id is not None:
+        candidates = (Image.objects.filter(thumbnail_sizes__blob=image.blob_id, blob__isnull=False,
+                                           rendition__in=[spec.fingerprint for spec in specs])
+                      .exclude(thumbnail_sizes=image).only('image', 'width', 'height', 'etag', 'blob', 'rendition'))
+        for candidate in candidates:
+            reusable.setdefault(candidate.rendition, candidate)
 
-        _, relative_path = root.split("\\media\\")
-        thumbnail_path = f"{relative_path}_{thumbnail_size}x{thumbnail_size}{ext}"
+    missing_specs = []
+    for spec in specs:
+        reused = reusable.get(spec.fingerprint)
+        if reused is None or not Blob.retain(reused.blob_id):
+            missing_specs.append(spec)
+            continue
+        thumbnails.append(Image(account_id=image.account_id, image=reused.image.name, width=reused.width,
+                                height=reused.height, thumbnail_sizes=image, etag=reused.etag,
+                                blob_id=reused.blob_id, rendition=spec.fingerprint, variant=spec.variant))
 
-        thumbnail = Image.objects.create(account_id=image.account.pk, image=thumbnail_path)
+    with image.image.open("rb") as original:
+        rendered = render_thumbnails(original, missing_specs)
+
+    for thumbnail in rendered:
+        buffer = BytesIO()
+        with THUMBNAIL_STAGE_LATENCY.labels("encode").time():
+            thumbnail.save(buffer)
+        digest = hashlib.sha256(buffer.getbuffer()).hexdigest()
+        # ORIGINAL specs keep the upload's extension unless the format changed, as for opaque PNGs
+        keep_ext = not thumbnail.spec.format and PILImage.registered_extensions().get(ext.lower()) == thumbnail.format
+        name = f"{thumbnail.spec.name}{ext if keep_ext else thumbnail.extension}"
+        with THUMBNAIL_STAGE_LATENCY.labels("store").time():
+            blob = Blob.acquire(ContentFile(buffer.getvalue(), name=name), digest)
+
+        thumbnails.append(Image(account_id=image.account_id, image=blob.file.name, width=thumbnail.image.width,
+                                height=thumbnail.image.height, thumbnail_sizes=image, etag=digest, blob=blob,
+                                rendition=thumbnail.spec.fingerprint, variant=thumbnail.spec.variant))
+
+
+@shared_task
+def prune_stale_thumbnails(user_id: int, image_id: int) -> int:
+    """Delete thumbnails of an original whose spec is no longer part of its owner's tier"""
+    account_tier = Account.get_tier(user_id=user_id)
+    fingerprints = [spec.fingerprint for spec in with_variants(account_tier.get_thumbnail_specs())]
+    # Thumbnails from before specs have no rendition and are always stale
+    stale = Image.objects.filter(account_id=user_id, thumbnail_sizes=image_id).exclude(rendition__in=fingerprints)
+    # Thumbnails from before blobs own their file, which no blob reference deletes
+    unshared = set(stale.filter(blob=None).values_list('image', flat=True))
+    # Deleting thumbnails refreshes the original's rendition cache once on commit, see signals.RenditionRefresh
+    _, deleted = stale.delete()
+    unshared -= set(Image.objects.filter(image__in=unshared).values_list('image', flat=True))
+    for name in unshared:
+        transaction.on_commit(lambda name=name: default_storage.delete(name))
+    return deleted.get(Image._meta.label, 0)
+
+
+@shared_task
+def reap_expired_expiration_links(batch_size: int | None = None, max_batches: int | None = None) -> int:
+    """Delete expired expiration links in bounded batches, oldest first"""
+    batch_size = batch_size or settings.EXPIRATION_LINK_REAPER_BATCH_SIZE
+    max_batches = max_batches or settings.EXPIRATION_LINK_REAPER_MAX_BATCHES
+    now = timezone.now()
+    started = time.monotonic()
+
+    reaped = batches = 0
+    while batches < max_batches:
+        with EXPIRATION_LINK_REAPER_BATCH_LATENCY.time():
+            link_ids = list(ExpirationLink.objects.filter(expires_at__lt=now).order_by('expires_at')
+                            .values_list('id', flat=True)[:batch_size])
+            if not link_ids:
+                break
+            ExpirationLink.objects.filter(id__in=link_ids).delete()
+        EXPIRATION_LINKS_REAPED.inc(len(link_ids))
+        reaped += len(link_ids)
+        batches += 1
+        if len(link_ids) < batch_size:
+            break
+
+    logger.info("Reaped %d expired expiration links in %d batches (%.3fs)", reaped, batches,
+                time.monotonic() - started,
+                extra={'reaped': reaped, 'batches': batches})
+    return reaped
+
+
+@shared_task
+def reap_expired_upload_sessions() -> int:
+    """Delete upload sessions that received no chunk for UPLOAD_SESSION_MAX_AGE, with their stored chunks"""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+    reaped = 0
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).only('id').iterator():
+        # Skipped if a chunk arrived meanwhile. A chunk still streaming in fails its compare-and-set instead
+        if UploadSession.objects.filter(id=session.id, updated_at__lt=cutoff).delete()[0]:
+            session.delete_parts()
+            reaped += 1
 
-        image.thumbnails.add(thumbnail)
+    logger.info("Reaped %d expired upload sessions", reaped, extra={'reaped': reaped})
+    return reaped
@@ -0,0 +1,159 @@
+import copy
+import re
+from typing import NamedTuple, TYPE_CHECKING
+
+from django.conf import settings
+from PIL import Image as PILImage
+
+from image_api.metrics import THUMBNAIL_STAGE_LATENCY
+
+try:
+    import pillow_avif  # noqa: F401 registers the AVIF plugin on Pillow builds without native support
+except ImportError:
+    pass
+
+if TYPE_CHECKING:
+    from image_api.models import ThumbnailSpec
+
+RESAMPLE = PILImage.Resampling.LANCZOS
+
+FIT_CONTAIN = "contain"
+FIT_COVER = "cover"
+FIT_CROP = "crop"
+
+FALLBACK_FORMAT = "WEBP"
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "AVIF": ".avif", "PNG": ".png"}
+
+PILImage.init()
+
+
+def parse_thumbnail_sizes(thumbnail_sizes: str | None) -> list[int]:
+    if not thumbnail_sizes:
+        return []
+    return sorted({int(size) for size in re.findall(r"\d+", thumbnail_sizes)}, reverse=True)
+
+
+def plan_thumbnail(size: tuple[int, int], spec: 'ThumbnailSpec') -> tuple[tuple[int, int], tuple[int, int] | None]:
+    """Return the aspect-preserving resize target for spec and the centered crop applied after it, if any"""
+    width, height = size
+    scales = [scale for scale in (spec.width and spec.width / width, spec.height and spec.height / height) if scale]
+    scale = min(scales) if spec.fit == FIT_CONTAIN else max(scales)
+    scale = min(scale, 1)
+    resized = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    if spec.fit == FIT_CROP and spec.width and spec.height:
+        return resized, (min(spec.width, resized[0]), min(spec.height, resized[1]))
+    return resized, None
+
+
+def output_format(spec: 'ThumbnailSpec', source_format: str, has_alpha: bool = False) -> str:
+    image_format = spec.format or source_format
+    if image_format == "PNG" and not spec.format and not has_alpha:
+        # Photos saved as PNG would otherwise get lossless thumbnails many times the size of a JPEG
+        image_format = "JPEG"
+    return image_format if image_format in PILImage.SAVE else FALLBACK_FORMAT
+
+
+def variant_formats() -> list[str]:
+    """Modern formats every thumbnail is also offered in, most preferred first"""
+    return [image_format for image_format in settings.THUMBNAIL_VARIANT_FORMATS if image_format in PILImage.SAVE]
+
+
+def variant_spec(spec: 'ThumbnailSpec', image_format: str) -> 'ThumbnailSpec':
+    """Copy of spec encoding to image_format, told apart from spec by its fingerprint"""
+    variant = copy.copy(spec)
+    variant.format = image_format
+    variant.variant = image_format
+    return variant
+
+
+def with_variants(specs: list['ThumbnailSpec']) -> list['ThumbnailSpec']:
+    return specs + [variant_spec(spec, image_format) for spec in specs for image_format in variant_formats()
+                    if image_format != spec.format]
+
+
+def accepted_mime_types(accept: str) -> dict[str, float]:
+    """Quality of every media type listed in an Accept header with a non-zero one, wildcards left as they are"""
+    mime_types = {}
+    for media_range in accept.split(","):
+        mime_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if mime_type and quality > 0:
+            mime_types[mime_type.lower()] = quality
+    return mime_types
+
+
+def negotiate_spec(spec: 'ThumbnailSpec', accept: str) -> 'ThumbnailSpec':
+    """Return the variant of spec in the modern format the client ranks highest in Accept, or spec itself"""
+    accepted = accepted_mime_types(accept)
+    # Browsers list modern formats explicitly, image/* does not promise AVIF support
+    formats = [image_format for image_format in variant_formats() if PILImage.MIME.get(image_format) in accepted]
+    if not formats:
+        return spec
+    # Equal qualities keep the order of THUMBNAIL_VARIANT_FORMATS
+    image_format = max(formats, key=lambda image_format: accepted[PILImage.MIME[image_format]])
+    return spec if image_format == spec.format else variant_spec(spec, image_format)
+
+
+class Thumbnail(NamedTuple):
+    spec: 'ThumbnailSpec'
+    image: PILImage.Image
+    format: str
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS.get(self.format, f".{self.format.lower()}")
+
+    def save(self, fp) -> None:
+        image = self.image
+        params = {}
+        if self.format in ("JPEG", "WEBP", "AVIF"):
+            params["quality"] = self.spec.quality
+        if self.format == "JPEG":
+            params.update(progressive=self.spec.progressive, optimize=True)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+        image.save(fp, self.format, **params)
+
+
+def decode_original(original: PILImage.Image, largest_size: tuple[int, int]) -> PILImage.Image:
+    """Decode the original, letting the JPEG decoder downscale it to the nearest DCT scale above largest_size"""
+    if original.format == "JPEG":
+        original.draft(original.mode, largest_size)
+    original.load()
+    if original.mode in ("1", "P"):
+        return original.convert("RGBA" if "transparency" in original.info else "RGB")
+    return original
+
+
+def render_thumbnails(fp, specs: list['ThumbnailSpec']) -> list[Thumbnail]:
+    """Decode the original once and build every spec from the previous, larger rendition"""
+    if not specs:
+        return []
+
+    original = PILImage.open(fp)
+    source_format = original.format
+    plans = sorted(((spec, *plan_thumbnail(original.size, spec)) for spec in specs),
+                   key=lambda plan: plan[1][0] * plan[1][1], reverse=True)
+
+    with THUMBNAIL_STAGE_LATENCY.labels("decode").time():
+        source = decode_original(original, plans[0][1])
+    has_alpha = "A" in source.getbands()
+    thumbnails = []
+    for spec, size, crop in plans:
+        with THUMBNAIL_STAGE_LATENCY.labels("resize").time():
+            if source.size != size:
+                source = source.resize(size=size, resample=RESAMPLE)
+            image = source
+            if crop:
+                left, top = (size[0] - crop[0]) // 2, (size[1] - crop[1]) // 2
+                image = source.crop((left, top, left + crop[0], top + crop[1]))
+        thumbnails.append(Thumbnail(spec, image, output_format(spec, source_format, has_alpha)))
+    return thumbnails
@@ -0,0 +1,102 @@
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler, StopUpload, SkipFile
+from PIL import Image as PILImage
+
+from image_api.exceptions import ServiceException
+
+ALLOWED_EXTENSIONS = ["jpg", "jpeg", "png"]
+IMAGE_SIGNATURES = {b"\x89PNG\r\n\x1a\n": "PNG", b"\xff\xd8\xff": "JPEG"}
+
+
+def read_image_header(header: bytes, complete: bool = False) -> tuple[str, tuple[int, int]] | None:
+    """Return format and size read from the first bytes of an image, or None while more bytes are needed"""
+    image_format = next((image_format for signature, image_format in IMAGE_SIGNATURES.items()
+                         if header.startswith(signature)), None)
+    if image_format is None:
+        if complete or not any(signature.startswith(header) for signature in IMAGE_SIGNATURES):
+            raise ServiceException(f"Invalid file extension. Allowed extensions are: {ALLOWED_EXTENSIONS}")
+        return None
+
+    try:
+        with PILImage.open(BytesIO(header), formats=[image_format]) as image:
+            width, height = image.size
+    except PILImage.DecompressionBombError:
+        raise ServiceException("Image dimensions are too large")
+    except Exception:
+        if complete or len(header) >= settings.IMAGE_HEADER_MAX_BYTES:
+            raise ServiceException("Could not read image dimensions")
+        return None
+
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise ServiceException("Image dimensions are too large")
+    return image_format, (width, height)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to a temporary file, rejecting anything but an image from its first chunk"""
+
+    def new_file(self, *args, **kwargs) -> None:
+        super().new_file(*args, **kwargs)
+        self.header = b""
+        self.image_header = None
+        self.digest = hashlib.sha256()
+
+    def reject(self, error: ServiceException):
+        self.request.image_upload_error = str(error)
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes | None:
+        try:
+            if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES:
+                raise ServiceException("File is too large")
+            if self.image_header is None:
+                self.header = (self.header + raw_data)[:settings.IMAGE_HEADER_MAX_BYTES]
+                self.image_header = read_image_header(self.header)
+        except ServiceException as e:
+            self.reject(e)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size: int):
+        try:
+            image_header = self.image_header or read_image_header(self.header, complete=True)
+        except ServiceException as e:
+            self.file.close()
+            return self.reject(e)
+
+        file = super().file_complete(file_size)
+        file.image_format, (file.image_width, file.image_height) = image_header
+        file.etag = self.digest.hexdigest()
+        return file
+
+
+class BatchImageUploadHandler(ImageUploadHandler):
+    """Like ImageUploadHandler, but only drops the offending file so the rest of a batch still uploads"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.file_index = -1
+        self.request.image_upload_errors = []
+
+    def new_file(self, *args, **kwargs) -> None:
+        self.file_index += 1
+        if self.file_index >= settings.IMAGE_BATCH_MAX_FILES:
+            # Stop before spooling a file the batch could never accept
+            self.request.image_upload_error = f"At most {settings.IMAGE_BATCH_MAX_FILES} files can be uploaded at once"
+            raise StopUpload(connection_reset=True)
+        super().new_file(*args, **kwargs)
+
+    def reject(self, error: ServiceException):
+        self.request.image_upload_errors.append((self.file_index, self.file_name, str(error)))
+        raise SkipFile()
+
+    def file_complete(self, file_size: int):
+        try:
+            file = super().file_complete(file_size)
+        except SkipFile:
+            return None
+        file.upload_index = self.file_index
+        return file
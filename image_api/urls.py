@@ -1,14 +1,41 @@
 
 from django.urls import path
-from image_api.views import ImageApiView, ExpirationLinkApiView
+
+from image_api import async_views
+from image_api.views import ImageApiView, ExpirationLinkApiView, ThumbnailApiView, UploadSessionApiView, \
+    SignedExpirationLinkApiView, ImageDownloadApiView, ImageBatchApiView, ImageStatusApiView, image_events, metrics
 
 urlpatterns = [
+    path('metrics/', metrics, name='metrics'),
     path('images/', ImageApiView.as_view(), name='image-create-list'),
     path('images/', ImageApiView.as_view(), name='user-images-list'),
     path('images/<int:image_id>/', ImageApiView.as_view(),
          name='user-image-detail'),
+    path('images/<int:image_id>/download/', ImageDownloadApiView.as_view(),
+         name='user-image-download'),
+    path('images/<int:image_id>/status/', ImageStatusApiView.as_view(),
+         name='user-image-status'),
+    path('images/events/', image_events, name='image-events'),
+    path('images/batch/', ImageBatchApiView.as_view(), name='image-batch-create'),
+    path('images/uploads/', UploadSessionApiView.as_view(), name='upload-session-create'),
+    path('images/uploads/<uuid:upload_id>/', UploadSessionApiView.as_view(),
+         name='upload-session-detail'),
+    path('images/<int:image_id>/thumb/<str:size>/', ThumbnailApiView.as_view(),
+         name='user-image-thumbnail'),
     path('images/<int:image_id>/expiration_link/',
          ExpirationLinkApiView.as_view(), name='expiration-link-create'),
     path('images/expiration_link/<uuid:link_id>/',
-         ExpirationLinkApiView.as_view(), name='expiration-link-get')
+         ExpirationLinkApiView.as_view(), name='expiration-link-get'),
+    path('images/expiration_link/<uuid:link_id>/download/',
+         ExpirationLinkApiView.as_view(), {'download': True}, name='expiration-link-download'),
+    path('images/expiration_link/signed/<str:token>/',
+         SignedExpirationLinkApiView.as_view(), name='signed-expiration-link-get'),
+    path('images/expiration_link/signed/<str:token>/download/',
+         SignedExpirationLinkApiView.as_view(), {'download': True}, name='signed-expiration-link-download'),
+    path('async/images/', async_views.list_images, name='async-user-images-list'),
+    path('async/images/<int:image_id>/', async_views.retrieve_image, name='async-user-image-detail'),
+    path('async/images/expiration_link/<uuid:link_id>/', async_views.redeem_expiration_link,
+         name='async-expiration-link-get'),
+    path('async/images/expiration_link/<uuid:link_id>/download/', async_views.redeem_expiration_link,
+         {'download': True}, name='async-expiration-link-download'),
 ]
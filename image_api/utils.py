@@ -1,3 +1,7 @@
 
 def user_directory_path(instance, filename):
     return f"user_{instance.account}/{filename}"
+
+
+def blob_path(digest: str, extension: str) -> str:
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
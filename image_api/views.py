@@ -1,5 +1,10 @@
+import hmac
 from uuid import UUID
 
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpRequest, JsonResponse
+from django.utils.cache import patch_vary_headers
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from rest_framework import status
 from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.generics import GenericAPIView
@@ -8,62 +13,209 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from image_api.etags import user_images_etag, not_modified, with_validators, make_etag, seconds_until
+from image_api.metrics import metrics_registry
 from image_api.exceptions import ServiceException
-from image_api.models import Image
-from image_api.serializers import ExpirationLinkOutputSerializer, ImageSerializer, ManyImagesOutputSerializer, \
-    ExpirationImageOutputSerializer
-from image_api.services import ImageService, ExpirationLinkService
-from image_api.tasks import create_thumbnail_sizes
+from image_api.models import Image, UploadSession
+from image_api.negotiation import IgnoreClientContentNegotiation
+from image_api.pagination import ImageCursorPagination
+from image_api.serializers import ExpirationLinkOutputSerializer, ImageSerializer, ExpirationImageOutputSerializer, \
+    UploadSessionOutputSerializer, SignedExpirationImageOutputSerializer
+from image_api.sendfile import serve_media
+from image_api.services import ImageService, ExpirationLinkService, ThumbnailService, UploadSessionService
+from image_api.upload_handlers import BatchImageUploadHandler
 
 
 class ImageApiView(GenericAPIView, RetrieveModelMixin):
     queryset = Image.objects.all()
     permission_classes = [IsAuthenticated, ]
     serializer_class = ImageSerializer
+    pagination_class = ImageCursorPagination
     http_method_names = ['post', 'get', 'retrieve']
 
     def post(self, request: Request) -> Response:
         """Upload image"""
         service = ImageService(request)
-        file = request.FILES["file"]
+        file = request.FILES.get("file")
+        if file is None:
+            error = getattr(request, "image_upload_error", "No file was submitted.")
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
         serializer = self.serializer_class(data={'image': file})
         serializer.is_valid(raise_exception=True)
         try:
             image = service.create_image(file=file)
-            create_thumbnail_sizes.delay(user_id=request.user.pk, image_path=image.image.path, image_id=image.pk)
+            service.schedule_thumbnails(image=image)
             return Response('Image successfully uploaded', status=status.HTTP_201_CREATED)
         except (ServiceException, ValidationError) as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except NotFound as e:
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
-    def get(self, request: Request) -> Response:
-        """List all images associated with user"""
+    def get(self, request: Request, image_id: int | None = None) -> Response:
+        """List all images associated with user, grouped by original with ?grouped=true"""
+        if image_id is not None:
+            return self.retrieve(request)
         service = ImageService(request=request)
         try:
-            images = service.return_image_sizes_based_on_tier()
-
-            serializer = ManyImagesOutputSerializer(data={'images': images})
-            serializer.is_valid(raise_exception=True)
-            data = serializer.validated_data
-            return Response(data, status=status.HTTP_200_OK)
+            etag = user_images_etag(request)
+            response = not_modified(request, etag=etag) or self.list_images(service)
+            return with_validators(response, etag=etag, private=True, no_cache=True)
         except (ServiceException, ValidationError) as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except NotFound as e:
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
+    def list_images(self, service: ImageService) -> Response:
+        if self.request.query_params.get('grouped') in ('true', '1'):
+            originals = self.paginate_queryset(service.get_originals_based_on_tier())
+            return self.get_paginated_response(service.return_grouped_image_sizes_based_on_tier(originals))
+        images = self.paginate_queryset(service.get_images_based_on_tier())
+        return self.get_paginated_response(service.return_image_sizes_based_on_tier(images=images))
+
     def retrieve(self, request: Request, *args, **kwargs) -> Response:
         """Retrieve one user image"""
         service = ImageService(request=request)
         try:
             image_id = self.kwargs["image_id"]
-            service.validate_access_to_image(image_id=image_id)
-            images = service.return_specific_image_sizes_based_on_tier(image_id=image_id)
+            etag = user_images_etag(request)
+            response = not_modified(request, etag=etag)
+            if response is None:
+                service.validate_access_to_image(image_id=image_id)
+                images = service.return_specific_image_sizes_based_on_tier(image_id=image_id)
+                response = Response({'images': images}, status=status.HTTP_200_OK)
+            return with_validators(response, etag=etag, private=True, no_cache=True)
+        except (ServiceException, ValidationError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
-            serializer = ManyImagesOutputSerializer(data={'images': images})
-            serializer.is_valid(raise_exception=True)
-            data = serializer.validated_data
-            return Response(data, status=status.HTTP_200_OK)
+
+class ImageBatchApiView(GenericAPIView):
+    queryset = Image.objects.all()
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['post']
+
+    def post(self, request: Request) -> Response:
+        """Upload several images in one request, reporting the outcome of each file"""
+        request._request.upload_handlers = [BatchImageUploadHandler(request._request)]
+        files = request.FILES.getlist("files")
+        error = getattr(request, "image_upload_error", None)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        rejected = request.image_upload_errors
+        if not files and not rejected:
+            return Response({'error': "No file was submitted."}, status=status.HTTP_400_BAD_REQUEST)
+
+        service = ImageService(request)
+        created, invalid = service.create_images(files=files)
+        service.schedule_batch_thumbnails(images=[image for _, image in created])
+
+        results = [(file.upload_index, {'file': file.name, 'status': 'created', 'id': image.pk})
+                   for file, image in created]
+        results.extend((file.upload_index, {'file': file.name, 'status': 'rejected', 'error': error})
+                       for file, error in invalid)
+        results.extend((index, {'file': name, 'status': 'rejected', 'error': error})
+                       for index, name, error in rejected)
+        return Response({'files': [result for _, result in sorted(results, key=lambda result: result[0])]},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+
+class ImageStatusApiView(GenericAPIView):
+    queryset = Image.objects.all()
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+
+    def get(self, request: Request, image_id: int) -> Response:
+        """Get thumbnail processing status of image"""
+        service = ImageService(request=request)
+        try:
+            return Response(service.get_image_status(image_id=image_id), status=status.HTTP_200_OK)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class ImageDownloadApiView(GenericAPIView):
+    queryset = Image.objects.all()
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+
+    def get(self, request: Request, image_id: int) -> HttpResponse:
+        """Download image file"""
+        service = ImageService(request=request)
+        try:
+            image = service.get_image_for_download(image_id=image_id)
+            etag = make_etag(image.etag) if image.etag else None
+            response = (not_modified(request, etag=etag, last_modified=image.created_at)
+                        or serve_media(image.image.name))
+            return with_validators(response, etag=etag, last_modified=image.created_at, private=True,
+                                   max_age=settings.IMAGE_CACHE_MAX_AGE)
+        except (ServiceException, ValidationError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class UploadSessionApiView(GenericAPIView):
+    queryset = UploadSession.objects.all()
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['post', 'get', 'put']
+
+    def post(self, request: Request) -> Response:
+        """Start resumable upload"""
+        service = UploadSessionService(request=request)
+        try:
+            session = service.create_upload_session()
+            serializer = UploadSessionOutputSerializer(session)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        except (ServiceException, ValidationError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def get(self, request: Request, upload_id: UUID) -> Response:
+        """Get offset to resume upload from"""
+        service = UploadSessionService(request=request)
+        try:
+            session = service.get_upload_session(upload_id=upload_id)
+            serializer = UploadSessionOutputSerializer(session)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+    def put(self, request: Request, upload_id: UUID) -> Response:
+        """Upload chunk described by Content-Range"""
+        service = UploadSessionService(request=request)
+        try:
+            result = service.upload_chunk(upload_id=upload_id)
+            if isinstance(result, UploadSession):
+                serializer = UploadSessionOutputSerializer(result)
+                return Response(serializer.data, status=status.HTTP_200_OK)
+            ImageService(request).schedule_thumbnails(image=result)
+            return Response('Image successfully uploaded', status=status.HTTP_201_CREATED)
+        except (ServiceException, ValidationError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class ThumbnailApiView(GenericAPIView):
+    queryset = Image.objects.all()
+    permission_classes = [IsAuthenticated, ]
+    content_negotiation_class = IgnoreClientContentNegotiation
+    http_method_names = ['get']
+
+    def get(self, request: Request, image_id: int, size: str) -> FileResponse | Response:
+        """Get thumbnail, rendering it on first request"""
+        service = ThumbnailService(request=request)
+        try:
+            image, spec = service.get_thumbnail(image_id=image_id, size=size)
+            etag = make_etag(image.etag, spec.fingerprint) if image.etag else None
+            response = not_modified(request, etag=etag, last_modified=image.created_at)
+            if response is None:
+                file, content_type = service.open_thumbnail(image=image, spec=spec)
+                response = FileResponse(file, content_type=content_type)
+            # The format follows the Accept header
+            patch_vary_headers(response, ["Accept"])
+            return with_validators(response, etag=etag, last_modified=image.created_at, private=True,
+                                   max_age=settings.IMAGE_CACHE_MAX_AGE)
         except (ServiceException, ValidationError) as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except NotFound as e:
@@ -89,16 +241,63 @@ class ExpirationLinkApiView(GenericAPIView):
         except NotFound as e:
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
-    def get(self, request: Request, link_id: UUID) -> Response:
+    def get(self, request: Request, link_id: UUID, download: bool = False) -> HttpResponse:
         """Get image from expiration link"""
         service = ExpirationLinkService(request=request)
         try:
-            expiration_link = service.get_image_from_expiration_link(link_id=link_id)
-            serializer = ExpirationImageOutputSerializer(data=expiration_link)
-            serializer.is_valid(raise_exception=True)
-            data = serializer.data
-            return Response(data, status=status.HTTP_200_OK)
+            link = service.get_expiration_link(link_id=link_id)
+            image = link.image
+            etag = make_etag(image.etag, download) if image.etag else None
+            response = not_modified(request, etag=etag, last_modified=image.created_at)
+            if response is None and download:
+                response = serve_media(image.image.name)
+            elif response is None:
+                serializer = ExpirationImageOutputSerializer(image)
+                response = Response(serializer.data, status=status.HTTP_200_OK)
+            return with_validators(response, etag=etag, last_modified=image.created_at, private=True,
+                                   max_age=seconds_until(link.expires_at))
         except (ServiceException, ValidationError) as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except NotFound as e:
             return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class SignedExpirationLinkApiView(GenericAPIView):
+    permission_classes = [IsAuthenticated, ]
+    http_method_names = ['get']
+
+    def get(self, request: Request, token: str, download: bool = False) -> HttpResponse:
+        """Get image from signed expiration link without touching the database"""
+        try:
+            expiration_link = ExpirationLinkService.get_signed_expiration_link(token=token)
+            etag = make_etag(token, download)
+            response = not_modified(request, etag=etag)
+            if response is None and download:
+                response = serve_media(expiration_link.image_name)
+            elif response is None:
+                serializer = SignedExpirationImageOutputSerializer(expiration_link)
+                response = Response(serializer.data, status=status.HTTP_200_OK)
+            return with_validators(response, etag=etag, private=True,
+                                   max_age=seconds_until(expiration_link.expires_at))
+        except (ServiceException, ValidationError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except NotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+def image_events(request: HttpRequest) -> HttpResponse:
+    """Refuse the event stream outside api.asgi, which serves it as image_api.asgi.image_events"""
+    # A WSGI worker would hold the stream open forever without ever flushing it to the client
+    return JsonResponse({'error': 'Image events are only served by the ASGI application'},
+                        status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Prometheus metrics of this process, or of every process sharing PROMETHEUS_MULTIPROC_DIR"""
+    token = settings.METRICS_AUTH_TOKEN
+    if not token:
+        return JsonResponse({'error': 'Metrics are not enabled'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return JsonResponse({'error': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
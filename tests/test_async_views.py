@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from image_api.models import AccountTier, Account, Image, ExpirationLink
+
+
+@override_settings(REST_FRAMEWORK={'PAGE_SIZE': 2})
+class AsyncImageViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+        cls.other_user = User.objects.create(
+            username='other',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=True
+        )
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+        cls.images = [Image.objects.create(account_id=cls.user.pk, image=f"user_{cls.user.pk}/{index}.png",
+                                           width=100, height=100, original_photo=True)
+                      for index in range(3)]
+        cls.other_image = Image.objects.create(account_id=cls.other_user.pk, image="other.png", width=100, height=100,
+                                               original_photo=True)
+        cls.expiration_link = ExpirationLink.objects.create(image=cls.images[0],
+                                                            expires_at=timezone.now() + timedelta(seconds=300))
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.headers = {'Authorization': f"Bearer {AccessToken.for_user(self.user)}"}
+
+    async def test_listing_is_paginated_by_keyset(self):
+        response = await self.async_client.get(reverse('async-user-images-list'), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()
+        self.assertEqual(len(first_page['images']), 2)
+        self.assertIn(f"before={self.images[1].pk}", first_page['next'])
+
+        response = await self.async_client.get(first_page['next'], headers=self.headers)
+        second_page = response.json()
+        self.assertEqual([image['url'] for image in second_page['images']], [self.images[0].url])
+        self.assertIsNone(second_page['next'])
+
+    async def test_listing_matches_sync_view(self):
+        sync_response = await self.async_client.get(reverse('user-images-list'), {'grouped': 'true'},
+                                                    headers=self.headers)
+        async_response = await self.async_client.get(reverse('async-user-images-list'), {'grouped': 'true'},
+                                                     headers=self.headers)
+        self.assertEqual(async_response.json()['images'], sync_response.json()['images'][:2])
+
+    @override_settings(IMAGE_VERSION_ETAGS=True)
+    async def test_unchanged_listing_is_not_modified(self):
+        response = await self.async_client.get(reverse('async-user-images-list'), headers=self.headers)
+        response = await self.async_client.get(reverse('async-user-images-list'),
+                                                headers={**self.headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_invalid_cursor_is_rejected(self):
+        response = await self.async_client.get(reverse('async-user-images-list'), {'before': 'abc'},
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_not_authenticated_user_cannot_access_listing(self):
+        response = await self.async_client.get(reverse('async-user-images-list'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_token_in_query_string_is_not_accepted(self):
+        response = await self.async_client.get(reverse('async-user-images-list'),
+                                               {'token': str(AccessToken.for_user(self.user))})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_detail_returns_image_sizes(self):
+        response = await self.async_client.get(reverse('async-user-image-detail',
+                                                       kwargs={'image_id': self.images[0].pk}), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['images'][0]['url'], self.images[0].url)
+
+    async def test_detail_of_another_users_image_is_denied(self):
+        response = await self.async_client.get(reverse('async-user-image-detail',
+                                                       kwargs={'image_id': self.other_image.pk}), headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_detail_of_missing_image_is_not_found(self):
+        response = await self.async_client.get(reverse('async-user-image-detail', kwargs={'image_id': 0}),
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_expiration_link_is_redeemed(self):
+        response = await self.async_client.get(reverse('async-expiration-link-get',
+                                                       kwargs={'link_id': self.expiration_link.pk}),
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.json())
+
+    async def test_expired_expiration_link_is_rejected(self):
+        link = await ExpirationLink.objects.acreate(image=self.images[0],
+                                                    expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = await self.async_client.get(reverse('async-expiration-link-get', kwargs={'link_id': link.pk}),
+                                               headers=self.headers)
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from image_api.authentication import CachedJWTAuthentication, TokenCache, token_cache
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.token = AccessToken.for_user(self.user)
+
+    def authenticate(self, token) -> tuple:
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {token}")
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_repeated_token_is_authenticated_without_queries(self):
+        self.authenticate(self.token)
+
+        with self.assertNumQueries(0):
+            user, token = self.authenticate(self.token)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(token['jti'], self.token['jti'])
+
+    def test_forged_token_with_cached_jti_is_rejected(self):
+        self.authenticate(self.token)
+        header, payload, signature = str(self.token).split('.')
+
+        with self.assertRaises(InvalidToken):
+            self.authenticate(f"{header}.{payload}.{signature[::-1]}")
+
+    def test_expired_token_is_not_served_from_cache(self):
+        self.token.set_exp(lifetime=timedelta(seconds=30))
+        self.authenticate(self.token)
+
+        with mock.patch('image_api.authentication.time.time', return_value=self.token['exp'] + 1):
+            self.assertIsNone(token_cache.get(self.token['jti'], str(self.token).encode()))
+
+    def test_deactivated_user_is_evicted(self):
+        self.authenticate(self.token)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(reverse('user-images-list'), HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.assertEqual(response.status_code, 401)
+
+    def test_least_recently_used_token_is_dropped(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        tokens = [AccessToken.for_user(self.user) for _ in range(3)]
+        for token in tokens:
+            cache.set(token['jti'], str(token).encode(), token, self.user)
+
+        self.assertIsNone(cache.get(tokens[0]['jti'], str(tokens[0]).encode()))
+        self.assertIsNotNone(cache.get(tokens[2]['jti'], str(tokens[2]).encode()))
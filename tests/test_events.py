@@ -0,0 +1,108 @@
+import asyncio
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from image_api.asgi import image_events
+from image_api.events import publish_image_event, image_events_channel
+
+
+class FakePubSub:
+    def __init__(self, messages: list[dict]):
+        self.messages = messages
+        self.channels = []
+
+    async def subscribe(self, channel: str) -> None:
+        self.channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages: bool, timeout: float) -> dict | None:
+        # Hands control back to the event loop like a real read does
+        await asyncio.sleep(0)
+        return self.messages.pop(0) if self.messages else None
+
+    async def unsubscribe(self) -> None:
+        self.channels = []
+
+    async def close(self) -> None:
+        pass
+
+
+@override_settings(IMAGE_EVENTS_REDIS_URL='redis://redis:6379/2')
+class ImageEventsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+    def test_status_change_is_published_to_user_channel(self):
+        with mock.patch('image_api.events.get_redis') as get_redis:
+            publish_image_event(self.user.pk, 7, 'ready')
+
+        get_redis.return_value.publish.assert_called_once_with(image_events_channel(self.user.pk),
+                                                               json.dumps({'id': 7, 'status': 'ready'}))
+
+    @override_settings(IMAGE_EVENTS_REDIS_URL='')
+    def test_nothing_is_published_when_events_are_disabled(self):
+        with mock.patch('image_api.events.get_redis') as get_redis:
+            publish_image_event(self.user.pk, 7, 'ready')
+
+        get_redis.assert_not_called()
+
+    def run_stream(self, query_string: bytes, messages: list[dict], disconnect_after: int | None = None) -> list:
+        """Drive image_api.asgi.image_events, disconnecting once disconnect_after body chunks were sent"""
+        pubsub = FakePubSub(messages)
+        client = mock.Mock(pubsub=mock.Mock(return_value=pubsub), close=mock.AsyncMock())
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if disconnect_after and len(sent) > disconnect_after:
+                disconnected.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': reverse('image-events'), 'query_string': query_string,
+                 'headers': []}
+        with mock.patch('image_api.events.redis.asyncio.from_url', return_value=client):
+            async_to_sync(image_events)(scope, receive, send)
+        return sent, pubsub, client
+
+    def test_events_are_streamed_until_client_disconnects(self):
+        token = str(AccessToken.for_user(self.user))
+        sent, pubsub, client = self.run_stream(f"token={token}".encode(),
+                                               [{'type': 'message', 'data': b'{"id": 7, "status": "ready"}'}],
+                                               disconnect_after=3)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[2]['body'], b'event: image\ndata: {"id": 7, "status": "ready"}\n\n')
+        self.assertEqual(sent[3]['body'], b': keepalive\n\n')
+        # The subscription is dropped as soon as the client goes away
+        self.assertEqual(pubsub.channels, [])
+        client.close.assert_awaited_once()
+
+    @override_settings(IMAGE_EVENTS_MAX_AGE=0)
+    def test_stream_ends_after_max_age(self):
+        token = str(AccessToken.for_user(self.user))
+        sent, _, client = self.run_stream(f"token={token}".encode(), [])
+
+        self.assertEqual([message.get('more_body', False) for message in sent[1:]], [True, False])
+        client.close.assert_awaited_once()
+
+    def test_events_require_authentication(self):
+        sent, _, _ = self.run_stream(b"token=invalid", [])
+        self.assertEqual(sent[0]['status'], 401)
+
+    def test_events_are_refused_outside_asgi(self):
+        response = self.client.get(reverse('image-events'))
+        self.assertEqual(response.status_code, 501)
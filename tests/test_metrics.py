@@ -0,0 +1,142 @@
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from image_api.metrics import CeleryQueueCollector
+from image_api.models import AccountTier, Account, Image, ExpirationLink
+from image_api.tasks import create_thumbnail_sizes, reap_expired_expiration_links
+from tests.utils import create_temporary_test_image
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsMiddlewareTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_latency_and_query_count_are_recorded_per_endpoint(self):
+        labels = {'endpoint': 'image-create-list', 'method': 'GET'}
+        requests = sample('image_api_request_duration_seconds_count', status='200', **labels)
+        queries = sample('image_api_request_queries_sum', **labels)
+
+        self.client.get(reverse('user-images-list'))
+
+        self.assertEqual(sample('image_api_request_duration_seconds_count', status='200', **labels), requests + 1)
+        self.assertGreater(sample('image_api_request_queries_sum', **labels), queries)
+        self.assertGreater(sample('image_api_response_size_bytes_sum', endpoint='image-create-list'), 0)
+
+    async def test_query_count_is_recorded_under_asgi(self):
+        headers = {'Authorization': f"Bearer {AccessToken.for_user(self.user)}"}
+        # A sync DRF view and an async one, both behind the async middleware chain
+        for url, name in ((reverse('user-images-list'), 'image-create-list'),
+                          (reverse('async-user-images-list'), 'async-user-images-list')):
+            labels = {'endpoint': name, 'method': 'GET'}
+            queries = sample('image_api_request_queries_sum', **labels)
+
+            response = await self.async_client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(sample('image_api_request_queries_sum', **labels), queries)
+
+    @override_settings(METRICS_AUTH_TOKEN='secret')
+    def test_metrics_endpoint_exposes_prometheus_text(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'image_api_request_duration_seconds_bucket', response.content)
+        self.assertIn(b'image_api_celery_queue_length', response.content)
+
+    @override_settings(METRICS_AUTH_TOKEN='secret')
+    def test_metrics_endpoint_requires_configured_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_AUTH_TOKEN='')
+    def test_metrics_endpoint_is_refused_without_configured_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 503)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ThumbnailMetricsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+        tier = AccountTier.objects.create(tier="Basic", thumbnail_sizes="200", original_link=False,
+                                          expiration_link=False)
+        Account.objects.create(user=cls.user, tier=tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    @override_settings(THUMBNAIL_VARIANT_FORMATS=[])
+    def test_thumbnail_stages_and_task_are_timed(self):
+        test_image = create_temporary_test_image(size=(600, 400))
+        image = Image.objects.create(image=ContentFile(test_image.getvalue(), test_image.name),
+                                     account_id=self.user.pk, original_photo=True)
+        before = {stage: sample('image_api_thumbnail_stage_duration_seconds_count', stage=stage)
+                  for stage in ('decode', 'resize', 'encode', 'store')}
+        tasks = sample('image_api_thumbnail_task_duration_seconds_count', outcome='success')
+
+        create_thumbnail_sizes.apply(kwargs={'user_id': self.user.pk, 'image_id': image.pk})
+
+        for stage, count in before.items():
+            self.assertEqual(sample('image_api_thumbnail_stage_duration_seconds_count', stage=stage), count + 1)
+        self.assertEqual(sample('image_api_thumbnail_task_duration_seconds_count', outcome='success'), tasks + 1)
+
+    def test_reaped_expiration_links_are_counted(self):
+        test_image = create_temporary_test_image()
+        image = Image.objects.create(image=ContentFile(test_image.getvalue(), test_image.name),
+                                     account_id=self.user.pk, original_photo=True)
+        ExpirationLink.objects.bulk_create(
+            ExpirationLink(image=image, expires_at=timezone.now() - timedelta(seconds=1)) for _ in range(3))
+        reaped = sample('image_api_expiration_links_reaped_total')
+        batches = sample('image_api_expiration_link_reaper_batch_duration_seconds_count')
+
+        reap_expired_expiration_links(batch_size=2)
+
+        self.assertEqual(sample('image_api_expiration_links_reaped_total'), reaped + 3)
+        self.assertEqual(sample('image_api_expiration_link_reaper_batch_duration_seconds_count'), batches + 2)
+
+
+class CeleryQueueCollectorTestCase(TestCase):
+    def test_queue_length_is_read_from_broker(self):
+        with mock.patch('api.celery.app.connection_for_read') as connection_for_read:
+            channel = connection_for_read.return_value.__enter__.return_value.default_channel
+            channel.queue_declare.side_effect = lambda queue, passive: (queue, {'thumbnails': 7}.get(queue, 0), 1)
+            metric, = CeleryQueueCollector().collect()
+
+        self.assertEqual({sample.labels['queue']: sample.value for sample in metric.samples},
+                         {'celery': 0, 'thumbnails': 7})
+
+    def test_unreachable_broker_does_not_fail_scrape(self):
+        with mock.patch('api.celery.app.connection_for_read', side_effect=OSError("connection refused")):
+            metric, = CeleryQueueCollector().collect()
+
+        self.assertEqual(metric.samples, [])
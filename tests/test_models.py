@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from image_api.models import AccountTier, Account
+
+
+class AccountGetTierTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.basic_tier = AccountTier.objects.create(
+            tier="Basic", thumbnail_sizes="200", original_link=False, expiration_link=False
+        )
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.basic_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_tier_is_resolved_from_cache_after_first_lookup(self):
+        with self.assertNumQueries(1):
+            Account.get_tier(user_id=self.user.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Account.get_tier(user_id=self.user.pk), self.basic_tier)
+
+    def test_cached_tier_is_invalidated_when_account_changes_tier(self):
+        Account.get_tier(user_id=self.user.pk)
+
+        self.user_account.tier = self.premium_tier
+        self.user_account.save()
+
+        self.assertEqual(Account.get_tier(user_id=self.user.pk), self.premium_tier)
+
+    def test_cached_tier_is_invalidated_when_tier_changes(self):
+        Account.get_tier(user_id=self.user.pk)
+
+        self.basic_tier.original_link = True
+        self.basic_tier.save()
+
+        self.assertTrue(Account.get_tier(user_id=self.user.pk).original_link)
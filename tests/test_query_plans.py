@@ -0,0 +1,84 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from image_api.models import AccountTier, Account, Image, ExpirationLink
+from image_api.services import ImageService
+
+USERS = 20
+ORIGINALS_PER_USER = 50
+
+
+class QueryPlanTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        tier = AccountTier.objects.create(tier="Premium", thumbnail_sizes="200, 400", original_link=True,
+                                          expiration_link=True)
+        cls.users = User.objects.bulk_create(User(username=f"user-{index}") for index in range(USERS))
+        Account.objects.bulk_create(Account(user=user, tier=tier) for user in cls.users)
+
+        originals = Image.objects.bulk_create(
+            Image(account=user, image=f"user_{user.pk}/{index}.png", width=1200, height=800, original_photo=True)
+            for user in cls.users for index in range(ORIGINALS_PER_USER))
+        Image.objects.bulk_create(
+            Image(account_id=original.account_id, image=f"{original.image.name}_{size}.png", width=size, height=size,
+                  original_photo=False, thumbnail_sizes=original, rendition=f"x{size}")
+            for original in originals for size in (200, 400))
+        Image.objects.bulk_create(
+            Image(account_id=original.account_id, image=f"{original.image.name}_200.webp", width=200, height=200,
+                  original_photo=False, thumbnail_sizes=original, rendition="x200-WEBP", variant="WEBP")
+            for original in originals)
+        cls.original = originals[len(originals) // 2]
+        links = ExpirationLink.objects.bulk_create(
+            ExpirationLink(image=original, expires_at=timezone.now() + timedelta(hours=1)) for original in originals)
+        cls.link = links[len(links) // 2]
+
+        # Planner statistics, as autovacuum or a periodic ANALYZE would keep them in production
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self) -> None:
+        user = User.objects.get(pk=self.original.account_id)
+        self.service = ImageService(SimpleNamespace(user=user))
+
+    def assertIndexScan(self, queryset: QuerySet, index: str | None = None) -> None:
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+            self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort\b')
+        else:
+            self.assertNotRegex(plan, r'\bSCAN (image|expiration_link)\b(?! USING)')
+            self.assertNotIn('TEMP B-TREE', plan)
+        if index:
+            self.assertIn(index, plan)
+
+    def test_listing_uses_account_index(self):
+        images = self.service.get_images_based_on_tier().order_by('-id')
+        self.assertIndexScan(images[:10], 'image_account_recent_idx')
+
+    def test_listing_deep_page_uses_account_index(self):
+        images = self.service.get_images_based_on_tier().order_by('-id').filter(id__lt=self.original.pk)
+        self.assertIndexScan(images[:10], 'image_account_recent_idx')
+
+    def test_thumbnail_only_listing_uses_account_index(self):
+        images = Image.objects.filter(account=self.original.account_id, variant=None, original_photo=False)
+        self.assertIndexScan(images.order_by('-id')[:10], 'image_account_recent_idx')
+
+    def test_grouped_listing_uses_originals_index(self):
+        originals = self.service.get_originals_based_on_tier().order_by('-id')
+        self.assertIndexScan(originals[:10], 'image_originals_idx')
+
+    @override_settings(THUMBNAIL_EAGER_RENDERING=True)
+    def test_detail_uses_primary_key_and_parent_index(self):
+        self.assertIndexScan(self.service.get_specific_image_sizes(self.original.pk))
+
+    def test_thumbnails_of_original_use_rendition_constraint(self):
+        self.assertIndexScan(Image.objects.filter(thumbnail_sizes=self.original.pk))
+
+    def test_expiration_link_redemption_uses_primary_key(self):
+        self.assertIndexScan(ExpirationLink.objects.select_related('image').filter(id=self.link.pk))
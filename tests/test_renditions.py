@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from image_api.renditions import RenditionCache
+
+
+class RenditionCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = RenditionCache(self.directory.name, max_bytes=300)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    @staticmethod
+    def write(size: int):
+        def render(path: str) -> None:
+            with open(path, "wb") as file:
+                file.write(b"x" * size)
+        return render
+
+    def test_concurrent_requests_render_once(self):
+        renders = []
+
+        def render(path: str) -> None:
+            renders.append(path)
+            time.sleep(0.1)
+            self.write(10)(path)
+
+        threads = [threading.Thread(target=self.cache.get_or_render, args=("key", render)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(renders), 1)
+        self.assertIsNotNone(self.cache.get("key"))
+
+    def test_least_recently_used_renditions_are_evicted_over_size_cap(self):
+        for key in ("first", "second", "third"):
+            self.cache.get_or_render(key, self.write(100))
+        os.utime(self.cache.path("first"), (time.time() + 10, time.time() + 10))
+
+        self.cache.get_or_render("fourth", self.write(100))
+
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNotNone(self.cache.get("fourth"))
+        with open(self.cache.usage_path) as usage:
+            self.assertEqual(int(usage.read()), 200)
+
+    def test_misses_under_size_cap_do_not_scan_the_cache(self):
+        self.cache.get_or_render("first", self.write(100))
+
+        with mock.patch.object(self.cache, "scan", wraps=self.cache.scan) as scan:
+            self.cache.get_or_render("second", self.write(100))
+        scan.assert_not_called()
@@ -0,0 +1,399 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import Image as PILImage
+
+from api.celery import app, THUMBNAIL_QUEUE
+from image_api.models import AccountTier, Account, Image, ThumbnailSpec, ExpirationLink, Blob, UploadSession
+from image_api.etags import image_version_key
+from image_api.management.commands.regenerate_thumbnails import regenerate
+from image_api.signals import RenditionRefresh
+from image_api.tasks import create_thumbnail_sizes, reap_expired_expiration_links, reap_expired_upload_sessions, \
+    store_thumbnails
+from image_api.thumbnails import render_thumbnails
+from tests.utils import create_temporary_test_image
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class CreateThumbnailSizesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        test_image = create_temporary_test_image(size=(1200, 800), image_format='JPEG')
+        image_file = ContentFile(test_image.getvalue(), test_image.name)
+        self.image = Image.objects.create(image=image_file, account_id=self.user.pk, original_photo=True)
+
+    def test_thumbnails_are_created_for_every_tier_size(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        sizes = sorted((thumbnail.width, thumbnail.height) for thumbnail in self.image.thumbnails.filter(variant=None))
+        self.assertEqual(sizes, [(300, 200), (600, 400)])
+
+    def test_thumbnails_store_content_hash_as_etag(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        for thumbnail in self.image.thumbnails.all():
+            with thumbnail.image.open("rb") as file:
+                self.assertEqual(thumbnail.etag, hashlib.sha256(file.read()).hexdigest())
+
+    def test_thumbnail_specs_control_fit_and_format(self):
+        ThumbnailSpec.objects.create(tier=self.premium_tier, width=300, height=300, fit=ThumbnailSpec.Fit.CROP,
+                                     format=ThumbnailSpec.Format.WEBP)
+        ThumbnailSpec.objects.create(tier=self.premium_tier, width=400, height=400, fit=ThumbnailSpec.Fit.CONTAIN,
+                                     format=ThumbnailSpec.Format.JPEG)
+        ThumbnailSpec.objects.create(tier=self.premium_tier, width=300, fit=ThumbnailSpec.Fit.COVER)
+
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        thumbnails = {thumbnail.rendition.split("-")[0] + os.path.splitext(thumbnail.image.name)[1]: thumbnail
+                      for thumbnail in self.image.thumbnails.filter(variant=None)}
+        self.assertEqual(sorted(thumbnails), ["300x.jpg", "300x300.webp", "400x400.jpg"])
+        self.assertEqual((thumbnails["300x300.webp"].width, thumbnails["300x300.webp"].height), (300, 300))
+        self.assertEqual((thumbnails["400x400.jpg"].width, thumbnails["400x400.jpg"].height), (400, 267))
+        self.assertEqual((thumbnails["300x.jpg"].width, thumbnails["300x.jpg"].height), (300, 200))
+        with PILImage.open(thumbnails["300x300.webp"].image) as thumbnail:
+            self.assertEqual(thumbnail.format, "WEBP")
+
+    def test_thumbnail_specs_are_cached_per_tier(self):
+        self.premium_tier.get_thumbnail_specs()
+
+        with self.assertNumQueries(0):
+            specs = AccountTier(pk=self.premium_tier.pk).get_thumbnail_specs()
+        self.assertEqual([spec.name for spec in specs], ["x400", "x200"])
+
+        ThumbnailSpec.objects.create(tier=self.premium_tier, width=100, height=100)
+        self.assertEqual([spec.name for spec in self.premium_tier.get_thumbnail_specs()], ["100x100"])
+
+    def test_thumbnail_rows_are_written_with_one_insert(self):
+        Account.get_tier(user_id=self.user.pk)
+        self.premium_tier.get_thumbnail_specs()
+
+        with CaptureQueriesContext(connection) as context:
+            create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT INTO "image"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_rendition_manifest_is_written_on_original(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        self.image.refresh_from_db()
+        thumbnails = self.image.thumbnails.select_related('blob')
+        self.assertEqual(set(self.image.renditions), {thumbnail.rendition for thumbnail in thumbnails})
+        for thumbnail in thumbnails:
+            self.assertEqual(self.image.renditions[thumbnail.rendition],
+                             {'id': thumbnail.pk, 'width': thumbnail.width, 'height': thumbnail.height,
+                              'path': thumbnail.image.name, 'bytes': thumbnail.blob.size, 'variant': thumbnail.variant})
+
+    def test_deleted_thumbnail_is_removed_from_rendition_manifest(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+        thumbnail = self.image.thumbnails.first()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            thumbnail.delete()
+        self.image.refresh_from_db()
+        self.assertNotIn(thumbnail.rendition, self.image.renditions)
+        self.assertEqual(len(self.image.renditions), self.image.thumbnails.count())
+
+    def test_deleted_thumbnails_refresh_rendition_manifest_once(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.image.thumbnails.all().delete()
+        self.assertEqual(len([callback for callback in callbacks if isinstance(callback, RenditionRefresh)]), 1)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.renditions, {})
+
+    def test_deleted_original_does_not_refresh_rendition_manifest(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Image.objects.filter(pk=self.image.pk).delete()
+        with mock.patch('image_api.models.Image.refresh_renditions') as refresh_renditions:
+            for callback in callbacks:
+                callback()
+        refresh_renditions.assert_not_called()
+
+    def test_modern_format_variants_are_stored_for_every_thumbnail(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        for thumbnail in self.image.thumbnails.exclude(variant=None):
+            with PILImage.open(thumbnail.image) as variant:
+                self.assertEqual(variant.format, thumbnail.variant)
+        variants = sorted(self.image.thumbnails.exclude(variant=None).values_list('height', 'variant'))
+        self.assertEqual(variants, [(200, 'WEBP'), (400, 'WEBP')])
+
+    @override_settings(THUMBNAIL_VARIANT_FORMATS=['AVIF', 'WEBP'])
+    def test_avif_variants_are_stored_when_enabled(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        variants = sorted(self.image.thumbnails.exclude(variant=None).values_list('height', 'variant'))
+        self.assertEqual(variants, [(200, 'AVIF'), (200, 'WEBP'), (400, 'AVIF'), (400, 'WEBP')])
+
+    def test_rerunning_does_not_duplicate_thumbnails(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+
+        self.assertEqual(self.image.thumbnails.filter(variant=None).count(), 2)
+        self.assertEqual(self.image.thumbnails.count(), 2 * (1 + len(settings.THUMBNAIL_VARIANT_FORMATS)))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, Image.Status.READY)
+
+    def test_failed_run_releases_the_blobs_it_stored(self):
+        with mock.patch('image_api.tasks.Image.refresh_renditions', side_effect=OSError("database unavailable")):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(OSError):
+                    store_thumbnails(user_id=self.user.pk, image_id=self.image.pk)
+
+        self.assertFalse(self.image.thumbnails.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_run_losing_a_race_drops_its_duplicate_renditions(self):
+        def finish_concurrent_run(original, specs):
+            with mock.patch('image_api.tasks.render_thumbnails', wraps=render_thumbnails):
+                store_thumbnails(user_id=self.user.pk, image_id=self.image.pk)
+            return render_thumbnails(original, specs)
+
+        with mock.patch('image_api.tasks.render_thumbnails', side_effect=finish_concurrent_run):
+            store_thumbnails(user_id=self.user.pk, image_id=self.image.pk)
+
+        self.assertEqual(self.image.thumbnails.count(), 2 * (1 + len(settings.THUMBNAIL_VARIANT_FORMATS)))
+        self.assertEqual(set(Blob.objects.values_list('ref_count', flat=True)), {1})
+
+    def test_status_changes_bump_listing_version(self):
+        key = image_version_key(self.user.pk)
+        cache.set(key, 1, None)
+
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+        # PROCESSING, the thumbnail insert and READY
+        self.assertEqual(cache.get(key), 4)
+
+    def test_transient_failure_is_retried(self):
+        with mock.patch('image_api.tasks.render_thumbnails', side_effect=[OSError("storage unavailable"), []]):
+            create_thumbnail_sizes.apply(kwargs={'user_id': self.user.pk, 'image_id': self.image.pk})
+
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, Image.Status.READY)
+
+    def test_undecodable_original_is_marked_failed_without_retry(self):
+        with mock.patch('image_api.tasks.render_thumbnails',
+                        side_effect=PILImage.UnidentifiedImageError("cannot identify image")) as render_thumbnails:
+            create_thumbnail_sizes.apply(kwargs={'user_id': self.user.pk, 'image_id': self.image.pk})
+
+        render_thumbnails.assert_called_once()
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, Image.Status.FAILED)
+
+    def create_original(self, user: User, content: bytes) -> Image:
+        digest = hashlib.sha256(content).hexdigest()
+        blob = Blob.acquire(ContentFile(content, name="test_image.jpg"), digest)
+        return Image.objects.create(image=blob.file.name, account_id=user.pk, original_photo=True, blob=blob,
+                                    etag=digest)
+
+    def test_thumbnails_of_known_content_are_reused(self):
+        other_user = User.objects.create(username='other', password='testpass')
+        Account.objects.create(user=other_user, tier=self.premium_tier)
+        content = create_temporary_test_image(size=(1200, 800), image_format='JPEG').getvalue()
+        first = self.create_original(self.user, content)
+        second = self.create_original(other_user, content)
+        self.assertEqual(first.blob_id, second.blob_id)
+
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=first.pk)
+        with mock.patch('image_api.tasks.render_thumbnails', return_value=[]) as render_thumbnails:
+            create_thumbnail_sizes(user_id=other_user.pk, image_id=second.pk)
+        render_thumbnails.assert_called_once_with(mock.ANY, [])
+
+        self.assertEqual(sorted(first.thumbnails.values_list('blob', flat=True)),
+                         sorted(second.thumbnails.values_list('blob', flat=True)))
+        self.assertEqual(set(Blob.objects.values_list('ref_count', flat=True)), {2})
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        content = create_temporary_test_image(size=(1200, 800), image_format='JPEG').getvalue()
+        first = self.create_original(self.user, content)
+        second = self.create_original(self.user, content)
+        name = first.blob.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(digest=first.etag).exists())
+        self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ReapExpiredExpirationLinksTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        test_image = create_temporary_test_image()
+        image_file = ContentFile(test_image.getvalue(), test_image.name)
+        cls.image = Image.objects.create(image=image_file, account_id=cls.user.pk)
+
+        ExpirationLink.objects.bulk_create(
+            ExpirationLink(image=cls.image, expires_at=timezone.now() - timedelta(seconds=index + 1))
+            for index in range(5)
+        )
+        cls.active_link = ExpirationLink.objects.create(image=cls.image,
+                                                        expires_at=timezone.now() + timedelta(seconds=300))
+
+    def test_expired_links_are_reaped_in_batches(self):
+        with self.assertNumQueries(6):
+            reaped = reap_expired_expiration_links(batch_size=2)
+
+        self.assertEqual(reaped, 5)
+        self.assertEqual(list(ExpirationLink.objects.all()), [self.active_link])
+
+    def test_reaping_stops_after_max_batches(self):
+        self.assertEqual(reap_expired_expiration_links(batch_size=2, max_batches=1), 2)
+        self.assertEqual(ExpirationLink.objects.count(), 4)
+
+    def test_management_command_reports_reaped_links(self):
+        out = StringIO()
+        call_command('reap_expiration_links', stdout=out)
+
+        self.assertIn('Reaped 5 expired expiration links', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir(), UPLOAD_SESSION_MAX_AGE=3600)
+class ReapExpiredUploadSessionsTestCase(TestCase):
+    def test_idle_sessions_are_reaped_with_their_chunks(self):
+        user = User.objects.create(username='test', password='testpass')
+        idle = UploadSession.objects.create(account=user, filename='idle.png', size=1000,
+                                            updated_at=timezone.now() - timedelta(hours=2))
+        active = UploadSession.objects.create(account=user, filename='active.png', size=1000)
+        names = [default_storage.save(session.part_name(0), ContentFile(b'x' * 100)) for session in (idle, active)]
+
+        self.assertEqual(reap_expired_upload_sessions(), 1)
+        self.assertEqual(list(UploadSession.objects.all()), [active])
+        self.assertFalse(default_storage.exists(names[0]))
+        self.assertTrue(default_storage.exists(names[1]))
+        active.delete_parts()
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir(), THUMBNAIL_VARIANT_FORMATS=[])
+class RegenerateThumbnailsCommandTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        test_image = create_temporary_test_image(size=(600, 400))
+        self.originals = [Image.objects.create(image=ContentFile(test_image.getvalue(), test_image.name),
+                                               account_id=self.user.pk, original_photo=True)
+                          for _ in range(3)]
+
+    def thumbnail_heights(self) -> list[list[int]]:
+        return [sorted(original.thumbnails.values_list('height', flat=True)) for original in self.originals]
+
+    def test_missing_thumbnails_are_rendered_for_every_original(self):
+        out = StringIO()
+        call_command('regenerate_thumbnails', '--chunk-size', '2', stdout=out)
+
+        self.assertEqual(self.thumbnail_heights(), [[200]] * 3)
+        self.assertIn('2/3 originals', out.getvalue())
+        self.assertIn('Regenerated thumbnails of 3 originals', out.getvalue())
+
+    def test_tier_change_replaces_stale_thumbnails_with_prune(self):
+        call_command('regenerate_thumbnails', stdout=StringIO())
+        ThumbnailSpec.objects.create(tier=self.tier, height=100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('regenerate_thumbnails', '--prune', stdout=StringIO())
+        self.assertEqual(self.thumbnail_heights(), [[100]] * 3)
+        for original in Image.objects.filter(pk__in=[original.pk for original in self.originals]):
+            self.assertEqual([rendition['height'] for rendition in original.renditions.values()], [100])
+
+    def test_prune_replaces_thumbnails_from_before_specs_and_their_files(self):
+        original = self.originals[0]
+        test_image = create_temporary_test_image(size=(300, 200))
+        legacy = Image.objects.create(image=ContentFile(test_image.getvalue(), test_image.name),
+                                      account_id=self.user.pk, thumbnail_sizes=original)
+        name = legacy.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('regenerate_thumbnails', '--prune', stdout=StringIO())
+        self.assertEqual(self.thumbnail_heights()[0], [200])
+        self.assertFalse(original.thumbnails.filter(rendition=None).exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_failed_original_is_marked_failed_by_processes_backend(self):
+        original = self.originals[0]
+        with mock.patch('image_api.management.commands.regenerate_thumbnails.create_thumbnail_sizes',
+                        side_effect=OSError("storage unavailable")):
+            with self.assertRaises(OSError):
+                regenerate(self.user.pk, original.pk, prune=False)
+
+        original.refresh_from_db()
+        self.assertEqual(original.status, Image.Status.FAILED)
+
+    def test_run_resumes_after_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            with open(checkpoint, 'w') as file:
+                file.write(f'{{"last_id": {self.originals[0].pk}}}')
+
+            call_command('regenerate_thumbnails', '--checkpoint', checkpoint, stdout=StringIO())
+
+            self.assertEqual(self.thumbnail_heights(), [[], [200], [200]])
+            with open(checkpoint) as file:
+                self.assertIn(str(self.originals[-1].pk), file.read())
+
+    def test_dispatch_is_paced_to_rate(self):
+        with mock.patch('image_api.management.commands.regenerate_thumbnails.time.sleep') as sleep:
+            call_command('regenerate_thumbnails', '--rate', '1', stdout=StringIO())
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertGreater(sleep.call_args_list[-1].args[0], 1)
+
+    def test_filters_select_originals_by_user(self):
+        call_command('regenerate_thumbnails', '--user', str(self.user.pk + 1), stdout=StringIO())
+        self.assertEqual(self.thumbnail_heights(), [[]] * 3)
+
+
+class TaskRoutingTestCase(TestCase):
+    def test_thumbnails_are_routed_to_their_own_queue(self):
+        route = app.amqp.router.route({}, create_thumbnail_sizes.name)
+        self.assertEqual(route['queue'].name, THUMBNAIL_QUEUE)
+
+        route = app.amqp.router.route({}, reap_expired_expiration_links.name)
+        self.assertEqual(route['queue'].name, app.conf.task_default_queue)
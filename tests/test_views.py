@@ -1,14 +1,29 @@
+import hashlib
+import os
 import tempfile
 from datetime import timedelta
-
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlparse, urljoin
+
+from PIL import Image as PILImage
+from decouple import config
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.utils import timezone
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.db import connection, DatabaseError
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
-from image_api.models import AccountTier, Image, ExpirationLink, Account
+from image_api.models import AccountTier, Image, ExpirationLink, Account, UploadSession, Blob
+from image_api.signing import SignedExpirationLink
+from image_api.tasks import create_thumbnail_sizes
+from image_api.upload_handlers import read_image_header, BatchImageUploadHandler
 from tests.utils import create_temporary_test_image
 
 
@@ -37,6 +52,7 @@ class ImageAPIViewTestCase(APITestCase):
         cls.image = Image.objects.create(image=image_file, account_id=cls.user.pk)
 
     def setUp(self) -> None:
+        cache.clear()
         self.client.force_authenticate(user=self.user)
 
     def test_authenticated_user_can_access_image_create_list_endpoint(self):
@@ -45,6 +61,46 @@ class ImageAPIViewTestCase(APITestCase):
         response = self.client.post(reverse('image-create-list'), data=data, format='multipart')
         self.assertEqual(response.status_code, 201)
 
+    def test_upload_of_non_image_file_is_rejected(self):
+        text_file = BytesIO(b'not an image' * 100)
+        text_file.name = 'test_image.png'
+
+        response = self.client.post(reverse('image-create-list'), data={'file': text_file}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid file extension', response.data['error'])
+
+    def test_upload_stores_content_hash_as_etag(self):
+        test_image = create_temporary_test_image()
+
+        response = self.client.post(reverse('image-create-list'), data={'file': test_image}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Image.objects.latest('id').etag, hashlib.sha256(test_image.getvalue()).hexdigest())
+
+    def test_upload_is_pending_until_thumbnails_are_ready(self):
+        response = self.client.post(reverse('image-create-list'), data={'file': create_temporary_test_image()},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 201)
+        image = Image.objects.latest('id')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-image-status', kwargs={'image_id': image.pk}))
+        self.assertEqual(response.data, {'id': image.pk, 'status': Image.Status.PENDING})
+
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=image.pk)
+        response = self.client.get(reverse('user-image-status', kwargs={'image_id': image.pk}))
+        self.assertEqual(response.data['status'], Image.Status.READY)
+
+    def test_identical_uploads_share_one_blob(self):
+        content = create_temporary_test_image().getvalue()
+        for _ in range(2):
+            response = self.client.post(reverse('image-create-list'),
+                                        data={'file': ContentFile(content, name='test_image.png')}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+
+        first, second = Image.objects.order_by('-id')[:2]
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.blob.ref_count, 2)
+
     def test_not_authenticated_user_cannot_access_image_create_list_endpoint(self):
         self.client.logout()
 
@@ -74,6 +130,458 @@ class ImageAPIViewTestCase(APITestCase):
         self.assertEqual(response.status_code, 401)
 
 
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ImageBatchAPIViewTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_batch_reports_status_of_every_file(self):
+        text_file = BytesIO(b'not an image' * 100)
+        text_file.name = 'notes.png'
+        files = [create_temporary_test_image(), text_file, create_temporary_test_image(size=(50, 50))]
+
+        with mock.patch('image_api.services.group') as group, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('image-batch-create'), data={'files': files}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.data['files']], ['created', 'rejected', 'created'])
+        self.assertIn('Invalid file extension', response.data['files'][1]['error'])
+
+        created = [result['id'] for result in response.data['files'] if result['status'] == 'created']
+        self.assertEqual(sorted(Image.objects.filter(account=self.user).values_list('id', flat=True)), sorted(created))
+        signatures = group.call_args.args[0]
+        self.assertEqual(sorted(signature.kwargs['image_id'] for signature in signatures), sorted(created))
+        group.return_value.apply_async.assert_called_once_with()
+
+    def test_batch_images_are_inserted_at_once(self):
+        files = [create_temporary_test_image() for _ in range(3)]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('image-batch-create'), data={'files': files}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT INTO "image"')]
+        self.assertEqual(len(inserts), 1)
+
+    @override_settings(IMAGE_BATCH_MAX_FILES=2)
+    def test_batch_size_is_limited(self):
+        files = [create_temporary_test_image() for _ in range(3)]
+
+        spooled = set()
+        receive_data_chunk = BatchImageUploadHandler.receive_data_chunk
+
+        def spool(handler, raw_data, start):
+            spooled.add(handler.file_index)
+            return receive_data_chunk(handler, raw_data, start)
+
+        with mock.patch.object(BatchImageUploadHandler, 'receive_data_chunk', spool):
+            response = self.client.post(reverse('image-batch-create'), data={'files': files}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 2 files', response.data['error'])
+        self.assertFalse(Image.objects.filter(account=self.user).exists())
+        # The third file is refused as it starts, before any of it is spooled
+        self.assertEqual(spooled, {0, 1})
+
+    def test_failed_insert_releases_stored_blobs(self):
+        files = [create_temporary_test_image(size=(size, size)) for size in (50, 60)]
+
+        with mock.patch('image_api.services.Image.objects.bulk_create', side_effect=DatabaseError("insert failed")):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('image-batch-create'), data={'files': files}, format='multipart')
+        self.assertFalse(Blob.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class UploadSessionAPIViewTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.test_image = create_temporary_test_image(size=(300, 200)).getvalue()
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def start_upload(self, size: int) -> dict:
+        response = self.client.post(reverse('upload-session-create'), data={'filename': 'test_image.png', 'size': size})
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put_chunk(self, upload_id, data: bytes, first: int, total: int):
+        return self.client.put(reverse('upload-session-detail', kwargs={'upload_id': upload_id}), data=data,
+                               content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f"bytes {first}-{first + len(data) - 1}/{total}")
+
+    def test_image_is_created_once_all_chunks_are_uploaded(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+
+        response = self.put_chunk(upload['id'], self.test_image[:100], 0, size)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['offset'], 100)
+
+        response = self.client.get(reverse('upload-session-detail', kwargs={'upload_id': upload['id']}))
+        self.assertEqual(response.data['offset'], 100)
+
+        response = self.put_chunk(upload['id'], self.test_image[100:], 100, size)
+        self.assertEqual(response.status_code, 201)
+        image = Image.objects.get(account=self.user, original_photo=True)
+        self.assertEqual((image.width, image.height), (300, 200))
+
+    def test_chunks_are_kept_in_default_storage_until_the_upload_completes(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+
+        self.put_chunk(upload['id'], self.test_image[:100], 0, size)
+        parts = UploadSession.objects.get(id=upload['id']).parts
+        self.assertEqual(len(parts), 1)
+        self.assertTrue(default_storage.exists(parts[0]))
+
+        self.put_chunk(upload['id'], self.test_image[100:], 100, size)
+        with Image.objects.get(account=self.user, original_photo=True).image.open('rb') as file:
+            self.assertEqual(file.read(), self.test_image)
+        self.assertFalse(default_storage.exists(parts[0]))
+
+    def test_upload_is_completed_by_a_retry_once_every_chunk_is_stored(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+
+        with mock.patch('image_api.services.ImageService.create_image', side_effect=OSError("storage unavailable")):
+            with self.assertRaises(OSError):
+                self.put_chunk(upload['id'], self.test_image, 0, size)
+        self.assertEqual(UploadSession.objects.get(id=upload['id']).offset, size)
+
+        response = self.client.put(reverse('upload-session-detail', kwargs={'upload_id': upload['id']}),
+                                   content_type='application/octet-stream', HTTP_CONTENT_RANGE=f"bytes */{size}")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Image.objects.filter(account=self.user, original_photo=True).exists())
+        self.assertFalse(UploadSession.objects.filter(id=upload['id']).exists())
+
+    def test_completing_retry_needs_every_chunk_stored(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+        self.put_chunk(upload['id'], self.test_image[:100], 0, size)
+
+        response = self.client.put(reverse('upload-session-detail', kwargs={'upload_id': upload['id']}),
+                                   content_type='application/octet-stream', HTTP_CONTENT_RANGE=f"bytes */{size}")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('resume from byte 100', response.data['error'])
+
+    def test_chunk_must_resume_from_current_offset(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+
+        response = self.put_chunk(upload['id'], self.test_image[100:], 100, size)
+        self.assertEqual(response.status_code, 400)
+
+    def test_chunk_committed_concurrently_wins_over_a_duplicate(self):
+        size = len(self.test_image)
+        upload = self.start_upload(size)
+
+        def concurrent_chunk(header, complete):
+            UploadSession.objects.filter(id=upload['id']).update(offset=100, parts=['other-request-part'])
+            return read_image_header(header, complete)
+
+        with mock.patch('image_api.services.read_image_header', side_effect=concurrent_chunk):
+            response = self.put_chunk(upload['id'], self.test_image[:100], 0, size)
+        self.assertEqual(response.status_code, 400)
+        session = UploadSession.objects.get(id=upload['id'])
+        self.assertEqual((session.offset, session.parts), (100, ['other-request-part']))
+        self.assertFalse(default_storage.exists(session.part_name(0)))
+
+    def test_upload_is_discarded_when_first_chunk_is_not_an_image(self):
+        upload = self.start_upload(1000)
+
+        response = self.put_chunk(upload['id'], b'x' * 100, 0, 1000)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.filter(id=upload['id']).exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ThumbnailAPIViewTestCase(APITestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cache_directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cache_directory.cleanup)
+        cls.enterClassContext(override_settings(THUMBNAIL_CACHE_DIR=cache_directory.name))
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+        test_image = create_temporary_test_image(size=(600, 300))
+        image_file = ContentFile(test_image.getvalue(), test_image.name)
+        cls.image = Image.objects.create(image=image_file, account_id=cls.user.pk, original_photo=True)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_thumbnail_is_rendered_on_first_request(self):
+        response = self.client.get(reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'}))
+        self.assertEqual(response.status_code, 200)
+        # Opaque PNG originals get JPEG thumbnails
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with PILImage.open(BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (400, 200)))
+
+    def test_thumbnail_of_transparent_png_stays_png(self):
+        test_image = create_temporary_test_image(size=(600, 300), mode='RGBA')
+        image = Image.objects.create(image=ContentFile(test_image.getvalue(), test_image.name),
+                                     account_id=self.user.pk, original_photo=True)
+
+        response = self.client.get(reverse('user-image-thumbnail', kwargs={'image_id': image.pk, 'size': 'x200'}))
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    @override_settings(THUMBNAIL_VARIANT_FORMATS=['AVIF', 'WEBP'])
+    def test_thumbnail_format_is_negotiated_from_accept_header(self):
+        url = reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'})
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif,image/webp,image/*;q=0.8')
+        self.assertEqual(response['Content-Type'], 'image/avif')
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.get(url, HTTP_ACCEPT='image/webp,image/*')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif;q=0,image/*')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    @override_settings(THUMBNAIL_VARIANT_FORMATS=['AVIF', 'WEBP'])
+    def test_thumbnail_format_follows_accept_quality(self):
+        url = reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'})
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif;q=0.5,image/webp')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_avif_is_not_served_unless_enabled(self):
+        url = reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'})
+
+        response = self.client.get(url, HTTP_ACCEPT='image/avif,image/webp')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    @override_settings(THUMBNAIL_VARIANT_FORMATS=['AVIF', 'WEBP'])
+    def test_stored_variant_is_served_without_rendering(self):
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=self.image.pk)
+        url = reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'})
+
+        with mock.patch('image_api.services.get_rendition_cache') as get_rendition_cache:
+            response = self.client.get(url, HTTP_ACCEPT='image/avif')
+        get_rendition_cache.assert_not_called()
+        with PILImage.open(BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('AVIF', (400, 200)))
+
+    def test_thumbnail_size_outside_of_tier_is_rejected(self):
+        response = self.client.get(reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x800'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_authenticated_user_cannot_access_thumbnail_endpoint(self):
+        self.client.logout()
+
+        response = self.client.get(reverse('user-image-thumbnail', kwargs={'image_id': self.image.pk, 'size': 'x200'}))
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ImageListAPIViewTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        Account.get_tier(user_id=self.user.pk)
+        self.client.force_authenticate(user=self.user)
+
+    def create_images(self, count: int) -> None:
+        Image.objects.bulk_create(
+            Image(account_id=self.user.pk, image=f"user_{self.user.pk}/test_image_{index}.png", width=100,
+                  height=100, original_photo=True)
+            for index in range(count)
+        )
+
+    def test_listing_query_count_does_not_depend_on_number_of_images(self):
+        self.create_images(3)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('user-images-list'))
+
+        self.create_images(30)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-images-list'))
+        self.assertEqual(len(response.data['images']), 10)
+
+    def test_listing_pages_are_followed_with_cursor(self):
+        self.create_images(25)
+
+        urls = []
+        next_page = reverse('user-images-list')
+        while next_page:
+            response = self.client.get(next_page)
+            self.assertEqual(response.status_code, 200)
+            urls.extend(image['url'] for image in response.data['images'])
+            next_page = response.data['next']
+
+        self.assertEqual(len(urls), 25)
+        self.assertEqual(len(set(urls)), 25)
+
+    def create_originals_with_thumbnails(self, count: int) -> None:
+        self.create_images(count)
+        originals = list(Image.objects.filter(account=self.user, original_photo=True, thumbnails__isnull=True))
+        Image.objects.bulk_create(
+            Image(account_id=self.user.pk, image=f"{original.image.name}_x{size}.png", width=size, height=size,
+                  thumbnail_sizes=original, rendition=f"x{size}")
+            for original in originals
+            for size in (200, 400)
+        )
+        for original in originals:
+            Image.refresh_renditions(original.pk)
+
+    def test_grouped_listing_nests_thumbnails_under_originals(self):
+        self.create_originals_with_thumbnails(2)
+
+        response = self.client.get(reverse('user-images-list'), {'grouped': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['images']), 2)
+        for original in response.data['images']:
+            self.assertEqual(original['size'], '100x100')
+            self.assertEqual(sorted(thumbnail['size'] for thumbnail in original['thumbnails']), ['200x200', '400x400'])
+
+    def test_listings_return_srcset_of_stored_thumbnails(self):
+        self.create_originals_with_thumbnails(1)
+        original = Image.objects.get(account=self.user, original_photo=True)
+        thumbnail = original.thumbnails.get(rendition='x200')
+        Image.objects.create(account_id=self.user.pk, image=f"{thumbnail.image.name}.webp", width=200, height=200,
+                             thumbnail_sizes=original, rendition='x200-WEBP', variant="WEBP")
+        original.refresh_renditions(original.pk)
+        urls = {thumbnail.rendition: thumbnail.url for thumbnail in original.thumbnails.all()}
+        srcset = f"{urls['x200']} 200w, {urls['x400']} 400w"
+
+        response = self.client.get(reverse('user-images-list'), {'grouped': 'true'})
+        self.assertEqual(response.data['images'][0]['srcset'], srcset)
+        self.assertEqual(response.data['images'][0]['sources'], {'image/webp': f"{urls['x200-WEBP']} 200w"})
+
+        cache.clear()
+        response = self.client.get(reverse('user-images-list'))
+        listed = next(image for image in response.data['images'] if image['url'] == original.url)
+        self.assertEqual(listed['srcset'], srcset)
+
+    def test_listing_leaves_out_format_variants(self):
+        self.create_originals_with_thumbnails(1)
+        thumbnail = Image.objects.filter(thumbnail_sizes__isnull=False).first()
+        Image.objects.create(account_id=self.user.pk, image=f"{thumbnail.image.name}.avif", width=200, height=200,
+                             thumbnail_sizes=thumbnail.thumbnail_sizes, variant="AVIF")
+
+        response = self.client.get(reverse('user-images-list'))
+        self.assertEqual(len(response.data['images']), 3)
+
+    def test_grouped_listing_query_count_does_not_depend_on_number_of_images(self):
+        self.create_originals_with_thumbnails(2)
+        # The first request also caches the tier's thumbnail specs
+        with self.assertNumQueries(2):
+            self.client.get(reverse('user-images-list'), {'grouped': 'true'})
+
+        self.create_originals_with_thumbnails(20)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('user-images-list'), {'grouped': 'true'})
+
+    @override_settings(IMAGE_VERSION_ETAGS=True)
+    def test_unchanged_listing_is_not_modified_without_queries(self):
+        self.create_images(3)
+        response = self.client.get(reverse('user-images-list'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('user-images-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(IMAGE_VERSION_ETAGS=False)
+    def test_listing_has_no_etag_without_shared_cache(self):
+        self.create_images(3)
+
+        response = self.client.get(reverse('user-images-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    @override_settings(IMAGE_VERSION_ETAGS=True)
+    def test_listing_etag_changes_with_images_and_tier(self):
+        self.create_images(3)
+        etag = self.client.get(reverse('user-images-list'))['ETag']
+
+        Image.objects.create(account_id=self.user.pk, image=f"user_{self.user.pk}/new.png", width=100, height=100,
+                             original_photo=True)
+        response = self.client.get(reverse('user-images-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        self.user_account.save()
+        response = self.client.get(reverse('user-images-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(IMAGE_VERSION_ETAGS=True, MEDIA_URL_MAX_AGE=3600)
+    def test_listing_etag_changes_before_presigned_urls_expire(self):
+        self.create_images(3)
+        with mock.patch('image_api.etags.time.time', return_value=0):
+            etag = self.client.get(reverse('user-images-list'))['ETag']
+        with mock.patch('image_api.etags.time.time', return_value=1799):
+            response = self.client.get(reverse('user-images-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with mock.patch('image_api.etags.time.time', return_value=1800):
+            response = self.client.get(reverse('user-images-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_returns_original_and_thumbnails(self):
+        self.create_originals_with_thumbnails(1)
+        original = Image.objects.get(account=self.user, original_photo=True)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('user-image-detail', kwargs={'image_id': original.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(image['size'] for image in response.data['images']), ['100x100', '200x200', '400x400'])
+
+    def test_listings_read_thumbnails_from_rendition_manifest(self):
+        self.create_originals_with_thumbnails(1)
+        original = Image.objects.get(account=self.user, original_photo=True)
+        thumbnail_urls = [thumbnail.url for thumbnail in original.thumbnails.order_by('pk')]
+
+        grouped = self.client.get(reverse('user-images-list'), {'grouped': 'true'})
+        detail = self.client.get(reverse('user-image-detail', kwargs={'image_id': original.pk}))
+        self.assertEqual([thumbnail['url'] for thumbnail in grouped.data['images'][0]['thumbnails']], thumbnail_urls)
+        self.assertEqual([image['url'] for image in detail.data['images'][1:]], thumbnail_urls)
+
+
 @override_settings(MEDIA_ROOT=tempfile.gettempdir())
 class ExpirationLinkAPIViewTestCase(APITestCase):
     @classmethod
@@ -102,6 +610,7 @@ class ExpirationLinkAPIViewTestCase(APITestCase):
         cls.user_account = Account.objects.create(user_id=cls.user.pk, tier_id=cls.enterprise_tier.pk)
 
     def setUp(self) -> None:
+        cache.clear()
         self.client.force_authenticate(user=self.user)
 
     def test_authenticated_user_can_access_expiration_link_create_endpoint(self):
@@ -125,3 +634,172 @@ class ExpirationLinkAPIViewTestCase(APITestCase):
 
         response = self.client.get(reverse('expiration-link-get', kwargs={'link_id': self.expiration_link.pk}))
         self.assertEqual(response.status_code, 401)
+
+    def test_expiration_link_is_stored_by_default(self):
+        data = {"expires_in": 300}
+
+        response = self.client.post(reverse('expiration-link-create', kwargs={'image_id': self.image.pk}), data=data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExpirationLink.objects.filter(image=self.image).count(), 2)
+
+    def test_signed_expiration_link_is_redeemed_without_queries(self):
+        data = {"expires_in": 300, "signed": True}
+
+        response = self.client.post(reverse('expiration-link-create', kwargs={'image_id': self.image.pk}), data=data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExpirationLink.objects.filter(image=self.image).count(), 1)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(urlparse(response.data['url']).path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['image'], self.image.image.url)
+
+    def test_tampered_signed_expiration_link_is_rejected(self):
+        token = SignedExpirationLink(self.image.image.name, timezone.now() + timedelta(seconds=300)).token
+        image_name, signature = token.rsplit(':', 1)
+
+        response = self.client.get(reverse('signed-expiration-link-get', kwargs={'token': f"{image_name}x:{signature}"}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_signed_expiration_link_is_rejected(self):
+        token = SignedExpirationLink(self.image.image.name, timezone.now() - timedelta(seconds=1)).token
+
+        response = self.client.get(reverse('signed-expiration-link-get', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('This link expired', response.data['error'])
+
+    @override_settings(MEDIA_SERVING_BACKEND='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_signed_expiration_link_download_is_handed_off_to_web_server(self):
+        token = SignedExpirationLink(self.image.image.name, timezone.now() + timedelta(seconds=300)).token
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('signed-expiration-link-download', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected-media/{self.image.image.name}")
+        self.assertEqual(response.content, b'')
+
+    def test_signed_expiration_link_download_of_deleted_file_is_not_found(self):
+        token = SignedExpirationLink("user_0/deleted.png", timezone.now() + timedelta(seconds=300)).token
+
+        response = self.client.get(reverse('signed-expiration-link-download', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('no longer exists', response.data['error'])
+
+    def test_unchanged_signed_expiration_link_is_not_modified(self):
+        token = SignedExpirationLink(self.image.image.name, timezone.now() + timedelta(seconds=300)).token
+        response = self.client.get(reverse('signed-expiration-link-get', kwargs={'token': token}))
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        response = self.client.get(reverse('signed-expiration-link-get', kwargs={'token': token}),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(MEDIA_SERVING_BACKEND='x-sendfile')
+    def test_expiration_link_download_is_handed_off_to_web_server(self):
+        response = self.client.get(reverse('expiration-link-download', kwargs={'link_id': self.expiration_link.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.image.image.path)
+
+
+@override_settings(MEDIA_ROOT=tempfile.gettempdir())
+class ImageDownloadAPIViewTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.basic_tier = AccountTier.objects.create(
+            tier="Basic", thumbnail_sizes="200", original_link=False, expiration_link=False
+        )
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200, 400", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+        cls.test_image = create_temporary_test_image()
+        image_file = ContentFile(cls.test_image.getvalue(), cls.test_image.name)
+        cls.image = Image.objects.create(image=image_file, account_id=cls.user.pk)
+        cls.image.etag = hashlib.sha256(cls.test_image.getvalue()).hexdigest()
+        cls.image.save()
+        thumbnail_file = ContentFile(cls.test_image.getvalue(), cls.test_image.name)
+        cls.thumbnail = Image.objects.create(image=thumbnail_file, account_id=cls.user.pk, thumbnail_sizes=cls.image)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_image_is_streamed_without_web_server_offload(self):
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(b''.join(response.streaming_content), self.test_image.getvalue())
+
+    @override_settings(MEDIA_SERVING_BACKEND='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_image_download_is_handed_off_to_web_server(self):
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected-media/{self.image.image.name}")
+
+    def test_unchanged_download_is_not_modified(self):
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}))
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_original_download_requires_original_link_tier(self):
+        Account.objects.filter(user=self.user).update(tier=self.basic_tier)
+
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.thumbnail.pk}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_authenticated_user_cannot_access_image_download_endpoint(self):
+        self.client.logout()
+
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': self.image.pk}))
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}})
+class InMemoryStorageTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(
+            username='test',
+            password='testpass')
+
+        cls.premium_tier = AccountTier.objects.create(
+            tier="Premium", thumbnail_sizes="200", original_link=True, expiration_link=False
+        )
+
+        cls.user_account = Account.objects.create(user=cls.user, tier=cls.premium_tier)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_images_are_stored_and_served_without_local_paths(self):
+        test_image = create_temporary_test_image(size=(400, 400))
+
+        response = self.client.post(reverse('image-create-list'), data={'file': test_image}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        original = Image.objects.get(account=self.user, original_photo=True)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, original.image.name)))
+
+        create_thumbnail_sizes(user_id=self.user.pk, image_id=original.pk)
+        self.assertEqual([(thumbnail.width, thumbnail.height) for thumbnail in original.thumbnails.filter(variant=None)],
+                         [(200, 200)])
+
+        response = self.client.get(reverse('user-image-download', kwargs={'image_id': original.pk}))
+        self.assertEqual(b''.join(response.streaming_content), test_image.getvalue())
+
+        response = self.client.get(reverse('user-images-list'))
+        self.assertIn(urljoin(config('root_domain'), original.image.url),
+                      [image['url'] for image in response.data['images']])
@@ -3,10 +3,10 @@ from io import BytesIO
 from PIL import Image
 
 
-def create_temporary_test_image():
+def create_temporary_test_image(size: tuple[int, int] = (100, 100), image_format: str = 'PNG', mode: str = 'RGB'):
     image_file = BytesIO()
-    image = Image.new('RGB', (100, 100), 'white')
-    image.save(image_file, 'PNG')
-    image_file.name = "test_image.png"
+    image = Image.new(mode, size, 'white')
+    image.save(image_file, image_format)
+    image_file.name = f"test_image.{image_format.lower()}"
     image_file.seek(0)
     return image_file